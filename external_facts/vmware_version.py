@@ -0,0 +1,124 @@
+#!/usr/bin/python3 -S
+# This file was generated from external_templates/vmware_version.py.in
+
+'''
+    vmware_version as a facter external fact: drop this in a facts.d directory, and facter runs
+    it and reads `vmware_version=...` off its output.  It answers the same as the ruby fact, but
+    doesn't need ruby or facter's own startup to do it: the mapping is a literal below, and the
+    BIOS details come straight out of the SMBIOS table, so a run is one interpreter start (with
+    -S, so not even site) and one small file read.
+
+    dmidecode is only run if the kernel doesn't export the table.  Not on VMware, no output.
+
+        vmware_version.py [TABLE]       # TABLE defaults to the kernel's; for testing
+'''
+import sys
+
+# BIOS address -> version.  Where one address has shown up with several release dates,
+# the key is (address, date) instead, and the address alone is not enough to know.
+VMVERSIONS = {
+    '0xEA550': '4.0',
+    '0xEA2E0': '4.1',
+    '0xE72C0': '5.0',
+    '0xEA0C0': '5.1',
+    '0xE9AB0': '5.1',
+    '0xEA050': '5.5',
+    '0xE9FE0': '5.5',
+    '0xE9A40': '6.0',
+    '0xE99E0': '6.0',
+    '0xEA580': '6.5',
+    '0xEA520': '6.7',
+}
+
+SMBIOS_TABLE = '/sys/firmware/dmi/tables/DMI'
+SYS_VENDOR = '/sys/class/dmi/id/sys_vendor'
+
+def smbios_string(strings, number):
+    ''' String number N of a structure, or None '''
+    if 0 < number <= len(strings):
+        return strings[number - 1].decode('ascii', 'replace')
+    return None
+
+def smbios_bios_information(tablefile):
+    '''
+        (address, date, system manufacturer) out of the raw SMBIOS table, formatted the way
+        dmidecode prints them, or None if the table can't be read or has no type 0 structure.
+    '''
+    try:
+        with open(tablefile, 'rb') as tablefilehandle:
+            table = tablefilehandle.read()
+    except OSError:
+        return None
+    bios = None
+    manufacturer = None
+    offset = 0
+    while offset + 4 <= len(table):
+        struct_type = table[offset]
+        length = table[offset + 1]
+        if struct_type == 127 or length < 4:
+            break
+        strings_end = table.find(b'\0\0', offset + length)
+        if strings_end < 0:
+            break
+        if struct_type == 0 and bios is None:
+            if length < 0x12:
+                return None
+            strings = table[offset + length:strings_end].split(b'\0')
+            segment = table[offset + 6] | table[offset + 7] << 8
+            bios = ('0x%04X0' % segment if segment else 'no_data',
+                    smbios_string(strings, table[offset + 8]) or 'no_data')
+        elif struct_type == 1 and manufacturer is None and length >= 5:
+            strings = table[offset + length:strings_end].split(b'\0')
+            manufacturer = smbios_string(strings, table[offset + 4]) or ''
+        if bios is not None and manufacturer is not None:
+            break
+        offset = strings_end + 2
+    if bios is None:
+        return None
+    return bios + (manufacturer,)
+
+def dmidecode_bios_information():
+    '''
+        The same from `dmidecode -t bios`, for kernels that don't export the table.
+    '''
+    import subprocess  # pylint: disable=import-outside-toplevel
+    try:
+        output = subprocess.run(['dmidecode', '-t', 'bios'], capture_output=True, text=True,
+                                check=False).stdout
+    except OSError:
+        return None
+    lines = output.splitlines()
+    for index, line in enumerate(lines):
+        if 'BIOS Information' not in line:
+            continue
+        fields = {'address': 'no_data', 'release date': 'no_data'}
+        for field_line in reversed(lines[index + 1:index + 5]):
+            key, _, value = field_line.strip().partition(': ')
+            if key.lower() in fields:
+                fields[key.lower()] = value
+        try:
+            with open(SYS_VENDOR, 'r') as vendorfilehandle:
+                manufacturer = vendorfilehandle.read().strip()
+        except OSError:
+            manufacturer = None
+        return fields['address'], fields['release date'], manufacturer
+    return None
+
+def main():
+    ''' Print the fact, if there is one '''
+    tablefile = sys.argv[1] if len(sys.argv) > 1 else SMBIOS_TABLE
+    bios_information = smbios_bios_information(tablefile)
+    if bios_information is None:
+        bios_information = dmidecode_bios_information()
+    if bios_information is None:
+        return
+    biosaddress, biosdate, manufacturer = bios_information
+    if manufacturer is not None and 'vmware' not in manufacturer.lower():
+        return
+    vmversion = VMVERSIONS.get(biosaddress)
+    if vmversion is None:
+        vmversion = VMVERSIONS.get((biosaddress, biosdate), f'unknown-{biosaddress}')
+    print(f'vmware_version={vmversion}')
+
+if __name__ == '__main__':
+    main()
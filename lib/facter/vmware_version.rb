@@ -1,54 +1,116 @@
 # This file was generated from templates/vmware_version.rb
 
 require 'facter'
+require 'json'
 
 # TODO: Verify this is required for the confine to work correctly.
 Facter.loadfacts()
 
+# BIOS address -> version.  Where one address has shown up with several release dates,
+# the key is [address, date] instead, and the address alone is not enough to know.
+vmversions = {
+#   Numbers from a prior life, which have only anecdotal proof.  Uncomment if you wish
+#    '0xE8480' => '2.5',
+#    '0xE7C70' => '3.0',
+#    '0xE7910' => '3.5',
+    '0xEA550' => '4.0',
+    '0xEA2E0' => '4.1',
+    '0xE72C0' => '5.0',
+    '0xEA0C0' => '5.1',
+    '0xE9AB0' => '5.1',
+    '0xEA050' => '5.5',
+    '0xE9FE0' => '5.5',
+    '0xE9A40' => '6.0',
+    '0xE99E0' => '6.0',
+    '0xEA580' => '6.5',
+    '0xEA520' => '6.7',
+}.freeze
+
+# Decode the BIOS Information (DMI type 0) structure from the raw SMBIOS table, so we don't
+# have to fork dmidecode.  Returns [address, date] formatted the way dmidecode prints them,
+# or nil if the table can't be read or has no type 0 structure.
+smbios_bios_information = lambda do |tablefile|
+    table = File.binread(tablefile)
+    offset = 0
+    while offset + 4 <= table.bytesize
+        type, length = table.unpack("@#{offset}CC")
+        break if type == 127 || length < 4
+        strings_end = table.index("\0\0".b, offset + length)
+        break if strings_end.nil?
+        if type == 0
+            return nil if length < 0x12
+            strings = table.byteslice(offset + length, strings_end - offset - length).split("\0".b)
+            segment = table.unpack1("@#{offset + 6}v")
+            date = table.unpack1("@#{offset + 8}C")
+            biosaddress = (segment == 0) ? 'no_data' : format('0x%04X0', segment)
+            biosdate = (date == 0 || strings[date - 1].nil?) ? 'no_data' : strings[date - 1]
+            return [biosaddress, biosdate]
+        end
+        offset = strings_end + 2
+    end
+    nil
+rescue SystemCallError, IOError
+    nil
+end
+
+# The BIOS can't change without a reboot, so the answer can be kept until then.
+# fact_cache_file is nil when the fact was generated without caching.
+fact_cache_file = nil
+mapping_version = '485730c2992854bf'
+
+current_boot_id = lambda do
+    File.read('/proc/sys/kernel/random/boot_id').strip
+rescue SystemCallError, IOError
+    nil
+end
+
+# A cached answer is only good for the boot, and the mapping and fact code, that it was worked
+# out with.
+# Anything missing, stale or unreadable just means we work it out again.
+read_fact_cache = lambda do |cachefile, boot_id|
+    cached = JSON.parse(File.read(cachefile))
+    if cached.is_a?(Hash) && cached['boot_id'] == boot_id &&
+            cached['mapping_version'] == mapping_version && cached['vmversion'].is_a?(String)
+        cached['vmversion']
+    end
+rescue SystemCallError, IOError, JSON::ParserError
+    nil
+end
+
+write_fact_cache = lambda do |cachefile, boot_id, vmversion|
+    tempfile = "#{cachefile}.#{Process.pid}"
+    File.write(tempfile, JSON.generate({'boot_id' => boot_id,
+                                        'mapping_version' => mapping_version,
+                                        'vmversion' => vmversion}))
+    File.rename(tempfile, cachefile)
+rescue SystemCallError, IOError
+    File.unlink(tempfile) rescue nil
+end
+
 Facter.add('vmware_version') do
     confine :kernel => 'Linux'
     confine :virtual => :vmware
     setcode {
-        biosinformation = Facter::Util::Resolution.exec("dmidecode -t bios | grep -A4 'BIOS Information'")
-        if !biosinformation.nil?
-
-            biosaddress = (biosinformation =~ /Address: (0x.*)/i) ? $1 : 'no_data'
-            biosdate = (biosinformation =~ /Release Date: (.*)/i) ? $1 : 'no_data'
-
-            if biosaddress == 'no_data'
-                vmversion = "unknown-#{biosaddress}"
-#           Numbers from a prior life, which have only anecdotal proof.  Uncomment if you wish
-#            elsif biosaddress == '0xE8480'
-#                vmversion = '2.5'
-#            elsif biosaddress == '0xE7C70'
-#                vmversion = '3.0'
-#            elsif biosaddress == '0xE7910'
-#                vmversion = '3.5'
-            elsif biosaddress == '0xEA550'
-                vmversion = '4.0'
-            elsif biosaddress == '0xEA2E0'
-                vmversion = '4.1'
-            elsif biosaddress == '0xE72C0'
-                vmversion = '5.0'
-            elsif biosaddress == '0xEA0C0'
-                vmversion = '5.1'
-            elsif biosaddress == '0xE9AB0'
-                vmversion = '5.1'
-            elsif biosaddress == '0xEA050'
-                vmversion = '5.5'
-            elsif biosaddress == '0xE9FE0'
-                vmversion = '5.5'
-            elsif biosaddress == '0xE9A40'
-                vmversion = '6.0'
-            elsif biosaddress == '0xE99E0'
-                vmversion = '6.0'
-            elsif biosaddress == '0xEA580'
-                vmversion = '6.5'
-            elsif biosaddress == '0xEA520'
-                vmversion = '6.7'
-            else
-                vmversion = "unknown-#{biosaddress}"
+        boot_id = fact_cache_file.nil? ? nil : current_boot_id.call
+        cached_vmversion = boot_id.nil? ? nil : read_fact_cache.call(fact_cache_file, boot_id)
+        next cached_vmversion unless cached_vmversion.nil?
+
+        biosaddress, biosdate = smbios_bios_information.call('/sys/firmware/dmi/tables/DMI')
+        if biosaddress.nil?
+            # Older kernels don't export the table; fall back to asking dmidecode.
+            biosinformation = Facter::Util::Resolution.exec("dmidecode -t bios | grep -A4 'BIOS Information'")
+            if !biosinformation.nil?
+                biosaddress = (biosinformation =~ /Address: (0x.*)/i) ? $1 : 'no_data'
+                biosdate = (biosinformation =~ /Release Date: (.*)/i) ? $1 : 'no_data'
             end
+        end
+
+        if !biosaddress.nil?
+            vmversion = vmversions.fetch(biosaddress) {
+                vmversions.fetch([biosaddress, biosdate], "unknown-#{biosaddress}")
+            }
+
+            write_fact_cache.call(fact_cache_file, boot_id, vmversion) unless boot_id.nil?
 
             # The effective return:
             vmversion
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+'''
+    Resolve a whole fleet's worth of `dmidecode -t bios` dumps in one go.
+
+    Dumps can come from a directory tree (any file in it is a dump), a tarball of the same,
+    or a JSONL file of {"host": ..., "dmidecode": ...} records.  Reading and parsing are fanned
+    out over a process pool (the parent only hands out paths, tar members' bytes or JSONL text),
+    and results are streamed out as CSV or JSONL in input order.  Only a bounded
+    number of dumps are in flight at once, so memory stays flat no matter how big the input is.
+
+        ./batch_resolve.py --minor /srv/dmidecodes.tar.gz > versions.csv
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import tarfile
+import threading
+from bios_resolver import BUILD_NUM_JSON_FILE, DMIDECODE_DIR, Resolver
+from dmidecode_scanner import bios_address_and_date, scan_bios_information
+from profiling import PROFILER, add_profile_arguments, profiled
+
+OUTPUT_FIELDS = ('host', 'address', 'date', 'version', 'error')
+
+# Set in each worker by init_worker, so the table is shipped once per process, not per dump.
+_lookup_table = {}
+
+# Each loader yields (host, kind, payload), and the worker reads the dump out of the payload:
+#   'path'  - a file, opened and scanned in the worker, only as far as its BIOS Information
+#   'bytes' - a tar member's raw contents, decoded and scanned in the worker
+#   'text'  - the dump itself
+
+def iter_directory(dirname):
+    '''
+        Every file under dirname is a dump; the host is its path relative to dirname.
+        Only paths are handed out; the workers do the reading.
+    '''
+    for root, _dirs, files in os.walk(dirname):
+        for file in sorted(files):
+            filepath = os.path.join(root, file)
+            yield os.path.relpath(filepath, dirname), 'path', filepath
+
+def iter_tarball(filename):
+    '''
+        Every regular file in the tarball is a dump; the host is its member name.
+        The tarball is read as a stream, so it is never unpacked; each member's bytes go to a
+        worker as they are, to be decoded and scanned there.
+    '''
+    with tarfile.open(filename, 'r|*') as tarball:
+        for member in tarball:
+            if not member.isfile():
+                continue
+            yield member.name, 'bytes', tarball.extractfile(member).read()
+
+def iter_jsonl(filename):
+    '''
+        One {"host": ..., "dmidecode": ...} record per line.
+    '''
+    with open(filename, 'r') as jsonl_filehandle:
+        for line in jsonl_filehandle:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield record['host'], 'text', record['dmidecode']
+
+def iter_dumps(source):
+    '''
+        Pick a reader for source based on what it is.
+    '''
+    if os.path.isdir(source):
+        return iter_directory(source)
+    if source.endswith('.jsonl') or source == '-':
+        return iter_jsonl('/dev/stdin' if source == '-' else source)
+    if os.path.isfile(source) and tarfile.is_tarfile(source):
+        return iter_tarball(source)
+    raise ValueError(f'Do not know how to read dumps from {source}')
+
+def init_worker(lookup_table):
+    ''' Process pool initializer '''
+    global _lookup_table  # pylint: disable=global-statement
+    _lookup_table = lookup_table
+
+def read_bios_fields(kind, payload):
+    '''
+        Worker side: the BIOS Information fields of one dump, however the loader sent it.
+    '''
+    if kind == 'path':
+        with open(payload, 'r', errors='replace') as dump_filehandle:
+            return scan_bios_information(dump_filehandle)
+    if kind == 'bytes':
+        payload = payload.decode('utf-8', errors='replace')
+    return scan_bios_information(io.StringIO(payload))
+
+def resolve_dump(host_kind_and_payload):
+    '''
+        Worker side: read and parse one dump and resolve it against the lookup table.
+    '''
+    host, kind, payload = host_kind_and_payload
+    fields = read_bios_fields(kind, payload)
+    parsed = bios_address_and_date(fields)
+    result = {'host': host, 'address': parsed['address'], 'date': parsed['date'],
+              'version': None, 'error': None}
+    if fields is None:
+        result['error'] = 'no BIOS Information block'
+        return result
+    if parsed['address'] is None:
+        result['error'] = 'no BIOS address found'
+        return result
+    version = _lookup_table.get(parsed['address'])
+    if version is None:
+        version = _lookup_table.get((parsed['address'], parsed['date']))
+    result['version'] = version
+    return result
+
+def bounded(iterable, semaphore):
+    '''
+        Hold back the pool's task feeder until there's room; the consumer releases the semaphore.
+        Pool.imap otherwise drains its whole input up front.
+    '''
+    for item in iterable:
+        semaphore.acquire()
+        yield item
+
+def batch_resolve(dumps, lookup_table, workers=None, chunksize=64, max_in_flight=None):
+    '''
+        Yield one result dict per dump, in input order.
+    '''
+    workers = workers or os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = workers * chunksize * 4
+    semaphore = threading.BoundedSemaphore(max_in_flight)
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(lookup_table,)) as pool:
+        for result in pool.imap(resolve_dump, bounded(dumps, semaphore), chunksize):
+            semaphore.release()
+            yield result
+
+def write_results(results, output_format, outfile):
+    '''
+        Stream results out as they arrive.
+    '''
+    if output_format == 'csv':
+        writer = csv.DictWriter(outfile, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+            PROFILER.count('dumps_resolved')
+    else:
+        for result in results:
+            print(json.dumps(result), file=outfile)
+            PROFILER.count('dumps_resolved')
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minor',
+                        action='store_true',
+                        default=False,
+                        dest='minor_version',
+                        help='Show minor versions')
+    parser.add_argument('--minor-error-high',
+                        action='store_true',
+                        default=False,
+                        dest='minor_high',
+                        help='Round minor-version guesses high')
+    parser.add_argument('--format',
+                        choices=('csv', 'jsonl'),
+                        default='csv',
+                        dest='output_format',
+                        help='Output format (default csv)')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes (default: one per core)')
+    parser.add_argument('--chunksize',
+                        type=int,
+                        default=64,
+                        help='Dumps handed to a worker at a time')
+    parser.add_argument('source',
+                        help='A directory, a tarball, or a .jsonl file (- for stdin) of dumps')
+    add_profile_arguments(parser)
+    cli_options = parser.parse_args(prog_args[1:])
+
+    with profiled(cli_options):
+        resolver = Resolver.from_files(BUILD_NUM_JSON_FILE, DMIDECODE_DIR)
+        with PROFILER.stage('lookup_table'):
+            lookup_table = resolver.lookup_table(minor=cli_options.minor_version,
+                                                 round_high=cli_options.minor_high)
+        try:
+            dumps = iter_dumps(cli_options.source)
+        except ValueError as err:
+            print(err, file=sys.stderr)
+            sys.exit(2)
+        # Reading and parsing happen in the workers, so this is the whole fan-out, as the
+        # parent sees it.
+        with PROFILER.stage('batch_resolve'):
+            results = batch_resolve(dumps, lookup_table, workers=cli_options.workers,
+                                    chunksize=cli_options.chunksize)
+            write_results(results, cli_options.output_format, sys.stdout)
+
+if __name__ == '__main__':
+    main()
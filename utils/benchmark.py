@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+'''
+    Time each stage of the pipeline against synthetic corpora of increasing size, and write the
+    results out as JSON so runs from different commits can be compared.
+
+        ./benchmark.py --sizes 1000 100000 1000000 --output bench.json
+
+    Corpora come from synthetic_corpus.py and are written to a scratch directory (or --workdir,
+    if you want to keep them around between runs; an existing corpus of the right size is reused).
+
+    It also times cold starts of the external fact, rendered from the real mapping, and exits
+    non-zero if the median start takes longer than --fact-startup-limit milliseconds.
+
+    batch_resolve.py is timed end to end, loaders included, over --batch-dumps copies of the real
+    dumps laid out as a directory and as a tarball: in one process with no pool, at one worker,
+    and at --batch-workers (every CPU, by default).  The speedup over one worker is reported.
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import tarfile
+import tempfile
+import time
+import batch_resolve
+import kb_parser
+import synthetic_corpus
+from bios_resolver import (DMIDECODE_DIR, Resolver, all_possible_builds, ingest_dmidecode_files,
+                           ingest_json, version_matching)
+from matchup_bios_to_string import render_output, render_template
+
+__location__ = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = (1000, 10000)
+TEMPLATE_FILE = os.path.join(__location__, 'templates', 'vmware_version.rb')
+EXTERNAL_FACT_TEMPLATE = os.path.join(__location__, 'external_templates', 'vmware_version.py.in')
+DEFAULT_FACT_RUNS = 20
+DEFAULT_FACT_STARTUP_LIMIT = 30.0
+DEFAULT_BATCH_DUMPS = 20000
+
+def best_of(repeat, function, *args):
+    '''
+        Run function(*args) repeat times; return (fastest wall time, last result).
+    '''
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def match_all_lines(lines):
+    ''' The match_one_line stage, over every line of the KB. '''
+    return [kb_parser.match_one_line(kb_parser.fields, line) for line in lines]
+
+def render_quietly(line_order, options):
+    ''' The render_output stage, with the rendered fact thrown away. '''
+    with contextlib.redirect_stdout(io.StringIO()):
+        render_output(line_order, options)
+
+def prepare_corpus(workdir, size, dump_fraction, seed):
+    '''
+        Make (or reuse) a synthetic corpus of size builds under workdir, JSON included.
+    '''
+    corpus_dir = os.path.join(workdir, f'corpus.{size}.{seed}.{dump_fraction}')
+    kb_filename = os.path.join(corpus_dir, 'raw_data_from_KB.txt')
+    json_filename = os.path.join(corpus_dir, 'esxi_build_numbers.json')
+    dmidecode_dirname = os.path.join(corpus_dir, 'dmidecode')
+    if not os.path.exists(json_filename):
+        os.makedirs(corpus_dir, exist_ok=True)
+        synthetic_corpus.write_corpus(corpus_dir, size, dump_fraction=dump_fraction, seed=seed)
+        with open(kb_filename, 'r') as kb_filehandle, open(json_filename, 'w') as json_filehandle:
+            kb_parser.emit_json(kb_parser.interpolate(kb_parser.parse_lines(kb_filehandle)),
+                                json_filehandle)
+    return kb_filename, json_filename, dmidecode_dirname
+
+def benchmark_size(workdir, size, options):
+    '''
+        Time every stage for one corpus size.  Returns a dict for the JSON report.
+    '''
+    kb_filename, json_filename, dmidecode_dirname = prepare_corpus(
+        workdir, size, options.dump_fraction, options.seed)
+    with open(kb_filename, 'r') as kb_filehandle:
+        kb_lines = kb_filehandle.readlines()
+    matching_options = Resolver.options(minor=options.minor_version, round_high=options.minor_high)
+    matching_options.templatefile = TEMPLATE_FILE
+
+    stages = {}
+    stages['match_one_line'], _ = best_of(options.repeat, match_all_lines, kb_lines)
+    stages['ingest_json'], builds = best_of(options.repeat, ingest_json, json_filename)
+    stages['ingest_dmidecode_files'], bioses = best_of(options.repeat, ingest_dmidecode_files,
+                                                       dmidecode_dirname)
+    stages['all_possible_builds'], possible_builds = best_of(
+        options.repeat, all_possible_builds, bioses, builds, matching_options)
+    stages['version_matching'], line_order = best_of(
+        options.repeat, version_matching, bioses, builds, possible_builds, matching_options)
+    stages['render_output'], _ = best_of(options.repeat, render_quietly, line_order,
+                                         matching_options)
+    return {'builds': size,
+            'kb_lines': len(kb_lines),
+            'dmidecode_files': len(bioses),
+            'output_lines': len(line_order),
+            'stages': stages,
+            'total': sum(stages.values())}
+
+def fact_startup(workdir, options):
+    '''
+        Run the external fact, rendered from the real mapping, against a table for an address it
+        knows, fact_runs times.  Returns a dict of start times (in ms) for the JSON report.
+    '''
+    resolver = Resolver.from_files()
+    line_order = resolver.line_order(minor=options.minor_version, round_high=options.minor_high)
+    fact_filename = os.path.join(workdir, 'vmware_version.py')
+    with open(fact_filename, 'w') as factfilehandle:
+        for line in render_template(line_order, EXTERNAL_FACT_TEMPLATE):
+            print(line, file=factfilehandle)
+    os.chmod(fact_filename, 0o755)
+    table_filename = os.path.join(workdir, 'DMI')
+    with open(table_filename, 'wb') as tablefilehandle:
+        tablefilehandle.write(synthetic_corpus.smbios_table(line_order[-1]))
+
+    timings = []
+    answer = None
+    for _ in range(options.fact_runs):
+        start = time.perf_counter()
+        answer = subprocess.run([fact_filename, table_filename], check=True,
+                                capture_output=True, text=True).stdout.strip()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'runs': options.fact_runs,
+            'answer': answer,
+            'median_ms': statistics.median(timings),
+            'max_ms': max(timings),
+            'limit_ms': options.fact_startup_limit}
+
+def prepare_fleet(workdir, count):
+    '''
+        Make (or reuse) count dumps under workdir, the real corpus's text dumps over and over,
+        as a directory of one file per host and as a tarball of that directory.
+        Returns (dirname, tarball filename).
+    '''
+    fleet_dir = os.path.join(workdir, f'fleet.{count}')
+    tarball_filename = f'{fleet_dir}.tar'
+    if not os.path.exists(tarball_filename):
+        corpus = sorted(os.path.join(dirname, file)
+                        for dirname, _dirs, files in os.walk(os.path.join(__location__,
+                                                                          DMIDECODE_DIR))
+                        for file in files if file.endswith('.txt'))
+        os.makedirs(fleet_dir, exist_ok=True)
+        for index in range(count):
+            shutil.copyfile(corpus[index % len(corpus)], os.path.join(fleet_dir, f'host{index}'))
+        with tarfile.open(f'{tarball_filename}.tmp', 'w') as tarball:
+            tarball.add(fleet_dir, arcname=os.path.basename(fleet_dir))
+        os.replace(f'{tarball_filename}.tmp', tarball_filename)
+    return fleet_dir, tarball_filename
+
+def resolve_all(source, lookup_table, workers):
+    '''
+        What batch_resolve.py does with source, less the output: load it with the real loader
+        and drain the pool.  With no workers, resolve in this process instead, for a pool-free
+        comparison.  Returns how many results came back.
+    '''
+    dumps = batch_resolve.iter_dumps(source)
+    if not workers:
+        batch_resolve.init_worker(lookup_table)
+        return sum(1 for dump in dumps if batch_resolve.resolve_dump(dump))
+    return sum(1 for _ in batch_resolve.batch_resolve(dumps, lookup_table, workers=workers))
+
+def batch_scaling(workdir, options):
+    '''
+        Time batch_resolve over batch_dumps dumps, from a directory and from a tarball, in this
+        process and with one worker and with batch_workers.  Returns a dict for the JSON report.
+    '''
+    resolver = Resolver.from_files()
+    lookup_table = resolver.lookup_table(minor=options.minor_version,
+                                         round_high=options.minor_high)
+    fleet_dir, tarball_filename = prepare_fleet(workdir, options.batch_dumps)
+
+    workers = options.batch_workers or os.cpu_count() or 1
+    sources = {}
+    for source_kind, source in (('directory', fleet_dir), ('tarball', tarball_filename)):
+        timings = {}
+        for worker_count in sorted({0, 1, workers}):
+            timings[worker_count], _ = best_of(options.repeat, resolve_all, source, lookup_table,
+                                               worker_count)
+        sources[source_kind] = {
+            'dumps_per_second': {(str(worker_count) if worker_count else 'in_process'):
+                                 options.batch_dumps / seconds
+                                 for worker_count, seconds in timings.items()},
+            'speedup': timings[1] / timings[workers]}
+    return {'dumps': options.batch_dumps,
+            'cpus': os.cpu_count(),
+            'workers': workers,
+            'sources': sources}
+
+def git_revision():
+    ''' The commit we're benchmarking, if we can tell. '''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=__location__, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=list(DEFAULT_SIZES),
+                        help='Corpus sizes, in KB builds')
+    parser.add_argument('--dump-fraction',
+                        type=float,
+                        default=0.25,
+                        dest='dump_fraction',
+                        help='Fraction of builds that get a dmidecode dump')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for the synthetic corpora')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help='Time each stage this many times and keep the fastest')
+    parser.add_argument('--minor',
+                        action='store_true',
+                        default=False,
+                        dest='minor_version',
+                        help='Benchmark with minor versions')
+    parser.add_argument('--minor-error-high',
+                        action='store_true',
+                        default=False,
+                        dest='minor_high',
+                        help='Benchmark rounding minor-version guesses high')
+    parser.add_argument('--fact-runs',
+                        type=int,
+                        default=DEFAULT_FACT_RUNS,
+                        dest='fact_runs',
+                        help='Start the external fact this many times')
+    parser.add_argument('--fact-startup-limit',
+                        type=float,
+                        default=DEFAULT_FACT_STARTUP_LIMIT,
+                        dest='fact_startup_limit',
+                        metavar='MS',
+                        help='Fail if the external fact\'s median start takes longer than <MS>')
+    parser.add_argument('--batch-dumps',
+                        type=int,
+                        default=DEFAULT_BATCH_DUMPS,
+                        dest='batch_dumps',
+                        help='How many dumps to push through batch_resolve.py')
+    parser.add_argument('--batch-workers',
+                        type=int,
+                        default=None,
+                        dest='batch_workers',
+                        help='Worker count to compare with one worker (default: every CPU)')
+    parser.add_argument('--workdir',
+                        metavar='DIR',
+                        help='Keep synthetic corpora in <DIR> instead of a scratch directory')
+    parser.add_argument('--output',
+                        metavar='FILE',
+                        help='Write the JSON report to <FILE> instead of stdout')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    with contextlib.ExitStack() as stack:
+        workdir = cli_options.workdir
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix='vmware_bench.'))
+        results = []
+        for size in cli_options.sizes:
+            results.append(benchmark_size(workdir, size, cli_options))
+            print(f'{size} builds: {results[-1]["total"]:.3f}s', file=sys.stderr)
+        external_fact = fact_startup(workdir, cli_options)
+        print(f'external fact: {external_fact["median_ms"]:.1f}ms median start',
+              file=sys.stderr)
+        batch_scaling_result = batch_scaling(workdir, cli_options)
+        for source_kind, source_result in batch_scaling_result['sources'].items():
+            print(f'batch_resolve from a {source_kind}: {source_result["speedup"]:.2f}x with '
+                  f'{batch_scaling_result["workers"]} workers over 1', file=sys.stderr)
+
+    report = {'revision': git_revision(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'repeat': cli_options.repeat,
+              'minor': cli_options.minor_version,
+              'minor_high': cli_options.minor_high,
+              'results': results,
+              'external_fact': external_fact,
+              'batch_resolve': batch_scaling_result}
+    json_text = json.dumps(report, indent=3)
+    if cli_options.output:
+        with open(cli_options.output, 'w') as outputfilehandle:
+            print(json_text, file=outputfilehandle)
+    else:
+        print(json_text)
+    if external_fact['median_ms'] > cli_options.fact_startup_limit:
+        print(f'external fact starts in {external_fact["median_ms"]:.1f}ms, over the '
+              f'{cli_options.fact_startup_limit:g}ms limit', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
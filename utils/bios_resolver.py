@@ -0,0 +1,359 @@
+'''
+    The guts of matchup_bios_to_string.py, as something you can import.
+
+    The Resolver here ingests the build sheet and the dmidecode corpus once, and can then answer
+    "what ESXi is this BIOS address and date?" as often as you like without going back to disk.
+
+        from bios_resolver import Resolver
+        resolver = Resolver.from_files()
+        resolver.resolve('0xEA520', '07/03/2018')                   # '6.7'
+        resolver.resolve('0xEA520', '07/03/2018', minor=True)       # '6.7u1'
+
+    gcox@mozilla
+'''
+import os
+import sys
+import re
+import argparse
+import io
+import json
+import dmidecode_scanner
+import smbios
+from dmidecode_scanner import (MalformedDump, bios_address_and_date, required_bios,
+                               scan_bios_information)
+from profiling import PROFILER
+
+# paths relative to this script:
+BUILD_NUM_JSON_FILE = '../build_numbers/esxi_build_numbers.json'
+DMIDECODE_DIR       = '../dmidecode'
+
+__location__ = os.path.dirname(__file__)
+
+def ingest_json(filename):
+    '''
+        Read in our JSON of VMware's build numbers, and build a hash of
+            build number -> version number
+        This is pretty much rendering our own 'pretty' version of the VMware KB.
+    '''
+    fullpath = os.path.join(__location__, filename)
+    with PROFILER.stage('ingest_json/read'):
+        with open(fullpath, 'r') as jsonfilehandle:
+            data = jsonfilehandle.read()
+        PROFILER.count('files_opened')
+        PROFILER.count('bytes_read', len(data))
+    with PROFILER.stage('ingest_json/json.loads'):
+        build_num_json = json.loads(data)
+
+    with PROFILER.stage('ingest_json/index'):
+        return index_builds(build_num_json)
+
+def index_builds(build_num_json):
+    '''
+        The build number -> version number hash of ingest_json, from the already-loaded list.
+    '''
+    all_builds = dict()
+    for build_ref in build_num_json:
+        for attr in ['build_number', 'installer_build_number']:
+            try:
+                int(build_ref[attr])
+            except ValueError:
+                continue
+            buildnum = build_ref[attr]
+            major_version = build_ref['major_version']
+            minor_version = (build_ref['major_version'] +
+                             build_ref['interpolated_update_version'])
+
+            all_builds[buildnum] = {'major': major_version,
+                                    'minor': minor_version}
+    return all_builds
+
+def parse_dmidecode_text(filecontents):
+    '''
+        Pull the BIOS address and release date out of the text of a `dmidecode` (-t bios, or the
+        whole thing).  Either comes back as None if the dump doesn't have it.
+    '''
+    return bios_address_and_date(scan_bios_information(io.StringIO(filecontents)))
+
+def extract_bios(filecontents):
+    '''
+        The address and date of one of our own dmidecode files, which had better have both:
+        MalformedDump if it doesn't.
+    '''
+    return required_bios(scan_bios_information(io.StringIO(filecontents)))
+
+def extract_smbios_bios(filecontents):
+    '''
+        The address and date of a binary SMBIOS dump (dmidecode.NUM.bin), which had better have both.
+    '''
+    try:
+        bios = smbios.bios_information(smbios.table_from_blob(filecontents))
+    except ValueError as err:
+        raise MalformedDump(str(err)) from err
+    if bios is None:
+        raise MalformedDump('no BIOS Information structure')
+    if bios['address'] is None or bios['date'] is None:
+        raise MalformedDump('BIOS Information has no address or no date')
+    return {'address': bios['address'], 'date': bios['date']}
+
+def extract_dmidecode_file(filepath, kind, cache=None):
+    '''
+        The address and date out of one dmidecode.NUM.txt or .bin (kind 'txt' or 'bin').
+        Without a cache there's nothing to hash, so a text dump is only read as far as the end
+        of its BIOS Information block.  MalformedDump if it doesn't have both.
+    '''
+    # .txt is the text of `dmidecode` (-t bios or not), .bin is a raw SMBIOS table.
+    if kind == 'txt' and cache is None:
+        with PROFILER.stage('ingest_dmidecode_files/scan'):
+            with open(filepath, 'r') as dmidecode_filehandle:
+                PROFILER.count('files_opened')
+                return required_bios(scan_bios_information(dmidecode_filehandle))
+    with PROFILER.stage('ingest_dmidecode_files/read'):
+        if kind == 'bin':
+            extract = extract_smbios_bios
+            parsers = (smbios, sys.modules[__name__])
+            with open(filepath, 'rb') as dmidecode_filehandle:
+                filecontents = dmidecode_filehandle.read()
+        else:
+            extract = extract_bios
+            parsers = (dmidecode_scanner, sys.modules[__name__])
+            with open(filepath, 'r') as dmidecode_filehandle:
+                filecontents = dmidecode_filehandle.read()
+        PROFILER.count('files_opened')
+        PROFILER.count('bytes_read', len(filecontents))
+    with PROFILER.stage('ingest_dmidecode_files/extract'):
+        if cache is None:
+            return extract(filecontents)
+        return cache.get(f'dmidecode.{kind}', filecontents, extract, parsers=parsers)
+
+def ingest_dmidecode_files(dirname, cache=None):
+    '''
+        This is a search over our dmidecode directory, and from that we build a dict of
+            build number -> BIOS Address and Dates
+        With a BuildCache, files whose contents we've seen before aren't searched again.
+        Dumps we can't get an address and date out of are reported on stderr and left out.
+    '''
+    all_bios = dict()
+    with PROFILER.stage('ingest_dmidecode_files/os.walk'):
+        found_files = [(root, file)
+                       for root, _dirs, files in os.walk(os.path.join(__location__, dirname))
+                       for file in files]
+    for root, file in found_files:
+        filenamematch = re.match(r'^dmidecode\.(\d+)\.(txt|bin)$', file)
+        if not filenamematch:
+            continue
+        buildnum = filenamematch.group(1)
+        filepath = os.path.join(root, file)
+        try:
+            all_bios[buildnum] = extract_dmidecode_file(filepath, filenamematch.group(2), cache)
+        except MalformedDump as err:
+            # One bad dump shouldn't take the whole mapping down with it.
+            print(f'{filepath}: {err}; skipping it', file=sys.stderr)
+            PROFILER.count('malformed_files')
+    return all_bios
+
+def all_possible_builds(bioses, builds, options):
+    '''
+        Search all of our BIOS dumps and connect them to the build sheet from VMware.
+        The result here is a hash of
+            biosaddress -> date -> version
+        This is a sort of 'reverse hash'.  Each ESX version has a BIOS version, but each
+        BIOS version can happen in multiple ESX versions.  We build that latter mapping
+        so we can match everyone up later.
+    '''
+    possible_builds = {}
+
+    if options.minor_version:
+        version_attr = 'minor'
+    else:
+        version_attr = 'major'
+    for buildnum, values in bioses.items():
+        address = values['address']
+        date = values['date']
+        version = builds[buildnum][version_attr]
+
+        possible_builds.setdefault(address, {}).setdefault(date, {}).setdefault(version, True)
+    return possible_builds
+
+def version_matching(bioses, builds, possibuilds, options):
+    '''
+        At this point, you have
+            BIOSes:  buildnum -> (BIOS address and date)
+            VMware:  buildnum -> (version)
+
+        Here we flatten the bios list down to unique combinations of address(+date) -> version
+        This uses the build number as the glue, but then gets the build number out of the way
+        since it has no meaning in the final results.
+
+        The 'weird' part in here is, a BIOS address can appear in multiple ESXi version.
+        So part of what we do in here is squish down to a single answer: address X is ESXi Y.
+        We hedge low or high based on the minor_high option.
+    '''
+    if options.minor_version:
+        version_attr = 'minor'
+    else:
+        version_attr = 'major'
+
+    last = {'address': '', 'date': '', 'version': ''}
+    line_order = []
+    # Each address/date's candidates only need sorting the first time we run into them.
+    sorted_versions = {}
+
+    for buildnum, values in sorted(bioses.items(), key = lambda kv: (builds[kv[0]]['minor'], kv)):
+        address = values['address']
+        date    = values['date']
+        version = builds[buildnum][version_attr]
+
+        # This section truncates dupes, so bypass it if we're going to dump everything:
+        if not options.dump:
+            # Since the only inputs we have are the address and date, we have to cheat here.
+            # Find the desired output version (round low or high) and go straight there.
+            possible_versions = sorted_versions.get((address, date))
+            if possible_versions is None:
+                possible_versions = sorted(possibuilds[address][date].keys(),
+                                           reverse=not options.minor_high)
+                sorted_versions[(address, date)] = possible_versions
+            version = possible_versions[0]
+            # Now that we've rounded $version, check if we've seen it before.
+            if (last['address'] == address) and (last['version'] == version):
+                continue
+            last['address'] = address
+            last['date'] = date
+            last['version'] = version
+
+        line_order.append({'address': address, 'date': date,
+                           'buildnum': buildnum, 'version': version})
+    return line_order
+
+def address_lookup_table(line_order):
+    '''
+        Squish the line order down to a lookup table of
+            address -> version              (for an address only seen with one date)
+            (address, date) -> version      (for an address seen with several dates)
+        The first line to claim a key wins, just as the first matching elsif would.
+    '''
+    addresses_considered = dict()
+    for line in line_order:
+        addresses_considered.setdefault(line["address"], {}
+                           ).setdefault(line["date"], {}
+                           ).setdefault(line["version"], True)
+    lookup_table = {}
+    for line in line_order:
+        address = line['address']
+        if len(addresses_considered[address]) > 1:
+            key = (address, line['date'])
+        else:
+            key = address
+        lookup_table.setdefault(key, line['version'])
+    return lookup_table
+
+
+# Every way we publish the mapping: variant name -> (minor, round_high)
+VARIANTS = {'major':      (False, False),
+            'major-high': (False, True),
+            'minor':      (True, False),
+            'minor-high': (True, True)}
+
+class MatchingEngine:
+    '''
+        all_possible_builds and version_matching for every variant, from one shared setup.
+        The BIOS list is sorted once, and each address/date's candidate versions are collected
+        and sorted once (both major and minor), so another variant is just one more walk.
+    '''
+    def __init__(self, bioses, builds):
+        self.builds = builds
+        self.sorted_bioses = sorted(bioses.items(),
+                                    key = lambda kv: (builds[kv[0]]['minor'], kv))
+        possible_versions = {'major': {}, 'minor': {}}
+        for buildnum, values in self.sorted_bioses:
+            key = (values['address'], values['date'])
+            for version_attr, candidates in possible_versions.items():
+                candidates.setdefault(key, set()).add(builds[buildnum][version_attr])
+        self.candidates = {version_attr: {key: sorted(versions)
+                                          for key, versions in candidates.items()}
+                           for version_attr, candidates in possible_versions.items()}
+
+    def line_order(self, minor=False, round_high=False, dump=False):
+        '''
+            What version_matching would give for these options.
+        '''
+        version_attr = 'minor' if minor else 'major'
+        candidates = self.candidates[version_attr]
+        # version_matching rounds by taking the first of the sorted candidates when rounding
+        # high, or the first of them reversed otherwise.
+        pick = 0 if round_high else -1
+
+        last = {'address': '', 'date': '', 'version': ''}
+        line_order = []
+        for buildnum, values in self.sorted_bioses:
+            address = values['address']
+            date    = values['date']
+            version = self.builds[buildnum][version_attr]
+            if not dump:
+                version = candidates[(address, date)][pick]
+                if (last['address'] == address) and (last['version'] == version):
+                    continue
+                last['address'] = address
+                last['date'] = date
+                last['version'] = version
+            line_order.append({'address': address, 'date': date,
+                               'buildnum': buildnum, 'version': version})
+        return line_order
+
+class Resolver:
+    '''
+        A prebuilt, in-memory index of BIOS address (and date) -> version.
+        Each combination of minor/round_high gets its own lookup table, built the first time
+        it is asked for and kept around after that, so every resolve() is a dict lookup or two.
+    '''
+    def __init__(self, builds, bioses):
+        self.builds = builds
+        self.bioses = bioses
+        self._engine = None
+        self._line_orders = {}
+        self._lookup_tables = {}
+
+    @classmethod
+    def from_files(cls, json_file=BUILD_NUM_JSON_FILE, dmidecode_dir=DMIDECODE_DIR, cache=None):
+        '''
+            Build a Resolver from the build number JSON and a dmidecode directory.
+        '''
+        return cls(ingest_json(json_file), ingest_dmidecode_files(dmidecode_dir, cache=cache))
+
+    @staticmethod
+    def options(minor=False, round_high=False, dump=False):
+        '''
+            The options object the matching functions expect, as the CLI would have built it.
+        '''
+        return argparse.Namespace(minor_version=minor, minor_high=round_high, dump=dump)
+
+    def line_order(self, minor=False, round_high=False, dump=False):
+        '''
+            The flattened address/date/buildnum/version lines, as version_matching makes them.
+        '''
+        key = (minor, round_high, dump)
+        if key not in self._line_orders:
+            if self._engine is None:
+                with PROFILER.stage('matching/setup'):
+                    self._engine = MatchingEngine(self.bioses, self.builds)
+            with PROFILER.stage('matching/line_order'):
+                self._line_orders[key] = self._engine.line_order(minor, round_high, dump)
+        return self._line_orders[key]
+
+    def lookup_table(self, minor=False, round_high=False):
+        '''
+            The address (or (address, date)) -> version table behind the generated fact.
+        '''
+        key = (minor, round_high)
+        if key not in self._lookup_tables:
+            self._lookup_tables[key] = address_lookup_table(self.line_order(minor, round_high))
+        return self._lookup_tables[key]
+
+    def resolve(self, address, date, minor=False, round_high=False):
+        '''
+            Answer the same way the generated fact would, or None if we've never seen this BIOS.
+        '''
+        table = self.lookup_table(minor, round_high)
+        version = table.get(address)
+        if version is None:
+            version = table.get((address, date))
+        return version
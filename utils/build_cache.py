@@ -0,0 +1,137 @@
+'''
+    A persistent cache of parsed results, keyed by a hash of what was parsed.
+
+    Rebuilds re-read every input either way, but anything whose content hasn't changed since
+    last time gets its parse result straight from here instead of going back through the regexes.
+    Results are kept in sections ('kb' lines, 'dmidecode' files); a section that gets used in a
+    run is pruned down to the entries that run asked for, so the file doesn't grow forever.
+    A section can name the modules that do its parsing: it is then filed under a digest of their
+    source too, so changing a parser throws away what the old one made of things.
+
+    Several runs can share one cache file (`make -j`): saves are serialized with a lock, each
+    one merges into what's on disk rather than overwriting sections it didn't use, and goes
+    through its own temporary file.
+
+    gcox@mozilla
+'''
+import os
+import sys
+import copy
+import hashlib
+import json
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): saves from parallel runs can lose each other's sections.
+    fcntl = None
+
+CACHE_FORMAT_VERSION = 1
+
+_source_versions = {}
+
+def source_version(modules):
+    '''
+        A short digest of the source of modules, so results can be filed under the parser
+        that produced them.
+    '''
+    names = tuple(module.__name__ for module in modules)
+    if names not in _source_versions:
+        digest = hashlib.sha256()
+        for module in modules:
+            with open(module.__file__, 'rb') as sourcefilehandle:
+                digest.update(sourcefilehandle.read())
+        _source_versions[names] = digest.hexdigest()[:12]
+    return _source_versions[names]
+
+def section_base(section):
+    ''' The section name without any parser version: 'kb' for 'kb@0123456789ab'. '''
+    return section.partition('@')[0]
+
+class BuildCache:
+    '''
+        content hash -> parse result, per section, saved to a JSON file between runs.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.sections = {}
+        self.used = {}
+        self.stats = {}
+        self.sections = self.load()
+
+    def load(self):
+        '''
+            The sections saved in the cache file, or none if there's no cache we can read.
+        '''
+        try:
+            with open(self.filename, 'r') as cachefilehandle:
+                cached = json.load(cachefilehandle)
+            if cached.get('version') == CACHE_FORMAT_VERSION:
+                return dict(cached['sections'])
+        except (OSError, ValueError, KeyError, AttributeError, TypeError):
+            # No cache, or one we can't read: start over, it's only a cache.
+            pass
+        return {}
+
+    @staticmethod
+    def content_hash(content):
+        ''' The key we file a result under. '''
+        if isinstance(content, str):
+            content = content.encode('utf-8', errors='surrogateescape')
+        return hashlib.sha256(content).hexdigest()
+
+    def get(self, section, content, compute, parsers=()):
+        '''
+            Return compute(content), from the cache if we've parsed this content before.
+            parsers are the modules compute's result depends on; results from a different
+            version of them aren't reused.
+            Results are handed back as copies, so callers are free to modify them.
+        '''
+        if parsers:
+            section = f'{section}@{source_version(parsers)}'
+        key = self.content_hash(content)
+        entries = self.sections.setdefault(section, {})
+        stats = self.stats.setdefault(section, {'reused': 0, 'recomputed': 0})
+        if key in entries:
+            stats['reused'] += 1
+        else:
+            entries[key] = compute(content)
+            stats['recomputed'] += 1
+        self.used.setdefault(section, set()).add(key)
+        return copy.deepcopy(entries[key])
+
+    def save(self):
+        '''
+            Write the cache back out, dropping anything the sections we used didn't ask for.
+        '''
+        used_bases = {section_base(section) for section in self.used}
+        with open(f'{self.filename}.lock', 'a') as lockfilehandle:
+            if fcntl is not None:
+                fcntl.flock(lockfilehandle, fcntl.LOCK_EX)
+            # Whatever other runs saved since we loaded stays, except older parser versions
+            # of the sections we used.
+            sections = {section: entries for section, entries in self.load().items()
+                        if section_base(section) not in used_bases}
+            for section, keys in self.used.items():
+                sections[section] = {key: value for key, value in self.sections[section].items()
+                                     if key in keys}
+            cache_dir = os.path.dirname(os.path.abspath(self.filename))
+            temp_fd, temp_filename = tempfile.mkstemp(dir=cache_dir,
+                                                      prefix=f'{os.path.basename(self.filename)}.')
+            try:
+                with os.fdopen(temp_fd, 'w') as cachefilehandle:
+                    json.dump({'version': CACHE_FORMAT_VERSION, 'sections': sections},
+                              cachefilehandle, separators=(',', ':'))
+                os.replace(temp_filename, self.filename)
+            except BaseException:
+                os.unlink(temp_filename)
+                raise
+        self.sections = sections
+
+    def report(self, outfile=sys.stderr):
+        '''
+            Say what we reused and what we had to redo.
+        '''
+        for section, stats in sorted(self.stats.items()):
+            print(f'build cache: {section}: {stats["reused"]} reused, '
+                  f'{stats["recomputed"]} recomputed', file=outfile)
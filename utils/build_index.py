@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+'''
+    "Which release does build N fall under?" for any N, not just the ones the KB lists.
+
+    ingest_json only knows exact build numbers, so a hot patch or custom build between two KB
+    rows resolves to nothing.  Here the build numbers of each major version are kept sorted in
+    a flat array, and a build resolves to the nearest KB release at or below it in its major.
+
+    Build numbers of different majors interleave (6.0 kept getting patches long after 6.5 was
+    out), so without --major a build inside the range of several majors is reported as
+    ambiguous, with the release each of them would give, rather than guessed at.
+
+        ./build_index.py --minor 10764712 10800000
+        cut -f3 vcenter_hosts.tsv | ./build_index.py -
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import bisect
+import json
+from array import array
+
+# paths relative to this script:
+BUILD_NUM_JSON_FILE = '../build_numbers/esxi_build_numbers.json'
+
+__location__ = os.path.dirname(__file__)
+
+class BuildIndex:
+    '''
+        Per major version, a sorted array('q') of build numbers and a parallel array('l') of
+        positions in the release list, plus one more pair (under None) across every major, for
+        spotting builds the KB lists.
+        Both build_number and installer_build_number are indexed, the same as ingest_json does.
+    '''
+    def __init__(self, releases):
+        self.releases = releases
+        pairs_by_major = {None: []}
+        for position, release in enumerate(releases):
+            for attr in ['build_number', 'installer_build_number']:
+                try:
+                    buildnum = int(release[attr])
+                except ValueError:
+                    continue
+                pairs_by_major.setdefault(release['major_version'], []).append((buildnum,
+                                                                                 position))
+                pairs_by_major[None].append((buildnum, position))
+        self.majors = sorted(major for major in pairs_by_major if major is not None)
+        self.builds = {}
+        self.positions = {}
+        for major, pairs in pairs_by_major.items():
+            pairs.sort()
+            self.builds[major] = array('q', (buildnum for buildnum, _position in pairs))
+            self.positions[major] = array('l', (position for _buildnum, position in pairs))
+
+    @classmethod
+    def from_json_file(cls, filename=BUILD_NUM_JSON_FILE):
+        '''
+            Build an index from our JSON of VMware's build numbers.
+        '''
+        fullpath = os.path.join(__location__, filename)
+        with open(fullpath, 'r') as jsonfilehandle:
+            return cls(json.load(jsonfilehandle))
+
+    def resolve(self, buildnum):
+        '''
+            The release build buildnum falls under, working out its major from the builds, as
+                {'release': ..., 'exact': ..., 'candidates': [...]}
+            A build the KB lists is its own release.  Otherwise its major is the one whose range
+            of builds it falls in, or failing that, the one whose builds end closest below it.
+            A build inside the range of several majors could be any of them: release is None,
+            and candidates holds each one's closest release at or below it.
+        '''
+        buildnum = int(buildnum)
+        every_build = self.builds[None]
+        index = bisect.bisect_right(every_build, buildnum)
+        exact = set()
+        while index and every_build[index - 1] == buildnum:
+            index -= 1
+            exact.add(self.positions[None][index])
+        if len(exact) == 1:
+            release = self.releases[exact.pop()]
+            return {'release': release, 'exact': True, 'candidates': [release]}
+        within = [major for major in self.majors
+                  if self.builds[major][0] <= buildnum <= self.builds[major][-1]]
+        if not within:
+            below = [major for major in self.majors if self.builds[major][-1] < buildnum]
+            within = [max(below, key=lambda major: self.builds[major][-1])] if below else []
+        candidates = [self.lookup(buildnum, major) for major in within]
+        return {'release': candidates[0] if len(candidates) == 1 else None,
+                'exact': False,
+                'candidates': candidates}
+
+    def resolve_many(self, buildnums):
+        '''
+            resolve() for a whole list of builds in one pass.  The queries are sorted once and
+            swept along the array across every major for the builds the KB lists.  The rest
+            are grouped by major (each major's range is a run of the sorted queries, found by
+            bisecting for its ends) and each group is swept along that major's array.
+            Results come back in the order they were asked.
+        '''
+        buildnums = [int(buildnum) for buildnum in buildnums]
+        order = sorted(range(len(buildnums)), key=buildnums.__getitem__)
+        sorted_buildnums = [buildnums[query] for query in order]
+        results = [None] * len(buildnums)
+
+        every_build = self.builds[None]
+        every_position = self.positions[None]
+        low = 0
+        for query in order:
+            low = bisect.bisect_left(every_build, buildnums[query], low)
+            exact = set()
+            index = low
+            while index < len(every_build) and every_build[index] == buildnums[query]:
+                exact.add(every_position[index])
+                index += 1
+            if len(exact) == 1:
+                release = self.releases[exact.pop()]
+                results[query] = {'release': release, 'exact': True, 'candidates': [release]}
+
+        candidates = {query: [] for query in order if results[query] is None}
+        for major in self.majors:
+            builds = self.builds[major]
+            start = bisect.bisect_left(sorted_buildnums, builds[0])
+            end = bisect.bisect_right(sorted_buildnums, builds[-1])
+            group = [query for query in order[start:end] if query in candidates]
+            for query, release in zip(group, self._sweep(major, [buildnums[query]
+                                                                 for query in group])):
+                candidates[query].append(release)
+        # Outside every major's range: the major whose builds end closest below.  On a tie,
+        # the first major, as resolve() has it.
+        ends = sorted((self.builds[major][-1], -rank, major)
+                      for rank, major in enumerate(self.majors))
+        end_builds = [end for end, _rank, _major in ends]
+        beyond = {}
+        for query in order:
+            if query in candidates and not candidates[query]:
+                index = bisect.bisect_left(end_builds, buildnums[query]) - 1
+                if index >= 0:
+                    beyond.setdefault(ends[index][2], []).append(query)
+        for major, group in beyond.items():
+            for query, release in zip(group, self._sweep(major, [buildnums[query]
+                                                                 for query in group])):
+                candidates[query].append(release)
+
+        for query, releases in candidates.items():
+            results[query] = {'release': releases[0] if len(releases) == 1 else None,
+                              'exact': False,
+                              'candidates': releases}
+        return results
+
+    def lookup(self, buildnum, major=None):
+        '''
+            The KB release that build buildnum falls under: the closest build at or below it,
+            in the given major version (or in the one resolve() works out).  None if it's older
+            than anything we know, we don't know that major at all, or it's ambiguous.
+        '''
+        if major is None:
+            return self.resolve(buildnum)['release']
+        if major not in self.builds:
+            return None
+        index = bisect.bisect_right(self.builds[major], int(buildnum)) - 1
+        if index < 0:
+            return None
+        return self.releases[self.positions[major][index]]
+
+    def lookup_many(self, buildnums, major=None):
+        '''
+            lookup() for a whole list of builds in one pass: sort the queries once, then sweep
+            the array alongside them, each search starting where the last one left off.
+            Results come back in the order they were asked.  Without a major, that's
+            resolve_many().
+        '''
+        if major is None:
+            return [resolved['release'] for resolved in self.resolve_many(buildnums)]
+        buildnums = [int(buildnum) for buildnum in buildnums]
+        results = [None] * len(buildnums)
+        if major not in self.builds:
+            return results
+        order = sorted(range(len(buildnums)), key=buildnums.__getitem__)
+        for query, release in zip(order, self._sweep(major, [buildnums[query]
+                                                             for query in order])):
+            results[query] = release
+        return results
+
+    def _sweep(self, major, sorted_buildnums):
+        '''
+            The release at or below each of sorted_buildnums (ascending) in major, in one
+            sweep along its array.
+        '''
+        builds = self.builds[major]
+        positions = self.positions[major]
+        releases = []
+        low = 0
+        for buildnum in sorted_buildnums:
+            low = bisect.bisect_right(builds, buildnum, low)
+            releases.append(self.releases[positions[low - 1]] if low else None)
+        return releases
+
+    @staticmethod
+    def version(release, minor=False):
+        ''' A release as the version string the rest of our tools use (6.0, or 6.0u2) '''
+        if release is None:
+            return None
+        if minor:
+            return release['major_version'] + release['interpolated_update_version']
+        return release['major_version']
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minor',
+                        action='store_true',
+                        default=False,
+                        dest='minor_version',
+                        help='Show minor versions')
+    parser.add_argument('--major',
+                        dest='major_version',
+                        metavar='X.Y',
+                        help='Only consider releases of this major version')
+    parser.add_argument('buildnums',
+                        nargs='+',
+                        metavar='BUILD',
+                        help='Build numbers to resolve, or - to read them one per line from stdin')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    if cli_options.buildnums == ['-']:
+        buildnums = [line.strip() for line in sys.stdin if line.strip()]
+    else:
+        buildnums = cli_options.buildnums
+    invalid = [buildnum for buildnum in buildnums if not buildnum.isdigit()]
+    if invalid:
+        print(f'Not build numbers: {" ".join(invalid)}', file=sys.stderr)
+        sys.exit(2)
+
+    index = BuildIndex.from_json_file(BUILD_NUM_JSON_FILE)
+    if cli_options.major_version is not None:
+        candidates = [[release] for release in
+                      index.lookup_many(buildnums, major=cli_options.major_version)]
+    else:
+        candidates = [resolved['candidates'] for resolved in index.resolve_many(buildnums)]
+    for buildnum, releases in zip(buildnums, candidates):
+        versions = [BuildIndex.version(release, minor=cli_options.minor_version)
+                    for release in releases if release is not None]
+        if len(versions) > 1:
+            print(f'{buildnum} ambiguous: {" ".join(versions)}')
+        else:
+            print(f'{buildnum} {versions[0] if versions else "unknown"}')
+
+if __name__ == '__main__':
+    main()
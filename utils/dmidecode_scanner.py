@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+'''
+    Read the BIOS Information (DMI type 0) block out of dmidecode's text output, a line at a
+    time, and stop as soon as the block is over.
+
+    Dumps don't have to be `dmidecode -t bios`: a full `dmidecode` can run to megabytes of
+    processors and memory devices, but type 0 comes first, so we never read past it.  Every
+    field of the block comes out in one pass; a dump with no block, or no usable address or
+    date in it, is a MalformedDump rather than a crash.
+
+        ./dmidecode_scanner.py ../dmidecode/dmidecode.NUM.txt
+
+    gcox@mozilla
+'''
+import sys
+import json
+import re
+from profiling import PROFILER
+
+HANDLE_MATCHER  = re.compile(r'^Handle 0x[0-9A-Fa-f]+, DMI type (\d+),')
+ADDRESS_PATTERN = re.compile(r'0x[0-9A-F]{5}')
+DATE_PATTERN    = re.compile(r'\d{2}/\d{2}/\d{4}')
+
+class MalformedDump(ValueError):
+    '''
+        A dump we can't get a BIOS address and release date out of.
+    '''
+
+def bios_information_lines(lines):
+    '''
+        Yield the lines of the first BIOS Information block: from its 'Handle ..., DMI type 0'
+        (or its 'BIOS Information' title, if that's where the dump starts) up to the blank line
+        or next handle that ends it.  Nothing after that is read.
+    '''
+    in_block = False
+    lines_scanned = 0
+    for line in lines:
+        lines_scanned += 1
+        line = line.rstrip('\r\n')
+        if not in_block:
+            handle_match = HANDLE_MATCHER.match(line)
+            if handle_match:
+                in_block = handle_match.group(1) == '0'
+            else:
+                in_block = line.strip() == 'BIOS Information'
+            if in_block:
+                yield line
+            continue
+        if not line.strip() or line.startswith('Handle '):
+            break
+        yield line
+    PROFILER.count('lines_scanned', lines_scanned)
+
+def bios_information_text(lines):
+    '''
+        Just the BIOS Information block, as text: all a batch loader needs to ship around.
+        Empty if there's no block.
+    '''
+    return ''.join(f'{line}\n' for line in bios_information_lines(lines))
+
+def scan_bios_information(lines):
+    '''
+        All the fields of the first BIOS Information block, as dmidecode labels them
+        ('Vendor', 'Release Date', 'Address', ...).  Fields that are a list (Characteristics)
+        come back as a list of their lines.  None if there's no such block.
+    '''
+    fields = None
+    field_indent = None
+    list_field = None
+    for line in bios_information_lines(lines):
+        stripped = line.strip()
+        indent = len(line) - len(line.lstrip())
+        if fields is None:
+            fields = {}
+            continue
+        if not indent or stripped == 'BIOS Information':
+            continue
+        if field_indent is None:
+            field_indent = indent
+        if indent > field_indent and list_field is not None:
+            fields[list_field].append(stripped)
+            continue
+        key, separator, value = stripped.partition(':')
+        if not separator:
+            continue
+        value = value.strip()
+        if value:
+            fields.setdefault(key, value)
+            list_field = None
+        else:
+            fields.setdefault(key, [])
+            list_field = key
+    return fields
+
+def bios_address_and_date(fields):
+    '''
+        {'address': ..., 'date': ...} from scan_bios_information's fields, either of them None
+        if the dump doesn't have it (or has something that isn't an address or a date).
+    '''
+    if fields is None:
+        fields = {}
+    address = fields.get('Address')
+    date = fields.get('Release Date')
+    return {'address': address if isinstance(address, str) and ADDRESS_PATTERN.fullmatch(address)
+                       else None,
+            'date': date if isinstance(date, str) and DATE_PATTERN.fullmatch(date) else None}
+
+def required_bios(fields):
+    '''
+        bios_address_and_date, for a dump that had better have both: MalformedDump if it doesn't.
+    '''
+    if fields is None:
+        raise MalformedDump('no BIOS Information block')
+    bios = bios_address_and_date(fields)
+    for key, label in (('address', 'Address'), ('date', 'Release Date')):
+        if bios[key] is None:
+            raise MalformedDump(f'BIOS Information has no usable {label} '
+                                f'(got {fields.get(label)!r})')
+    return bios
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    filename = prog_args[1] if len(prog_args) > 1 else '-'
+    try:
+        if filename == '-':
+            fields = scan_bios_information(sys.stdin)
+        else:
+            with open(filename, 'r', errors='replace') as dump_filehandle:
+                fields = scan_bios_information(dump_filehandle)
+        required_bios(fields)
+    except (OSError, MalformedDump) as err:
+        print(f'{filename}: {err}', file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(fields, indent=3))
+
+if __name__ == '__main__':
+    main()
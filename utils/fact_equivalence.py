@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+'''
+    Check that the hash-lookup fact (templates/vmware_version.rb) and the external python fact
+    (external_templates/vmware_version.py.in) answer every guest exactly as the elsif ladder
+    they replaced (oldtools/vmware_version.ladder.rb) does.
+
+    All three are rendered for every variant (major, minor, rounded low and high).  The ruby
+    ones run under a stand-in for facter that feeds them `dmidecode -t bios` output.  The python
+    one is asked twice: once with an SMBIOS table to read, and once without, so it falls back to
+    a stand-in dmidecode on its PATH.  They're asked about every address and date in the
+    corpus: the real one, and --corpora synthetic ones.  Addresses with a date they were never
+    seen with, addresses nobody has seen, and dumps with no address or no date are asked about
+    as well.
+
+        ./fact_equivalence.py
+        ./fact_equivalence.py --corpora 5 --seed 7
+
+    Exits non-zero if any answer differs.  Needs ruby, but not facter or dmidecode.
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import random
+import subprocess
+import tempfile
+import kb_parser
+import synthetic_corpus
+from bios_resolver import BUILD_NUM_JSON_FILE, DMIDECODE_DIR, VARIANTS, Resolver
+from matchup_bios_to_string import render_template
+
+__location__ = os.path.dirname(os.path.abspath(__file__))
+HASH_TEMPLATE = os.path.join(__location__, 'templates', 'vmware_version.rb')
+LADDER_TEMPLATE = os.path.join(__location__, 'oldtools', 'vmware_version.ladder.rb')
+EXTERNAL_TEMPLATE = os.path.join(__location__, 'external_templates', 'vmware_version.py.in')
+DEFAULT_CORPORA = 2
+DEFAULT_MAX_BUILDS = 2000
+# Asked about alongside the corpus: nobody's BIOS lives here, or was released then.
+UNKNOWN_ADDRESS = '0xFFFF0'
+UNKNOWN_DATE = '01/01/1970'
+
+# Just enough of facter to load a fact and ask it for its value.  The fact gets whatever
+# $dmidecode holds as the output of its dmidecode command, and never sees this machine's own
+# SMBIOS table.
+FACTER_STUB = '''
+module Facter
+    @facts = {}
+    def self.loadfacts
+    end
+    def self.add(name, &block)
+        fact = Fact.new
+        fact.instance_eval(&block)
+        @facts[name] = fact
+    end
+    def self.value(name)
+        @facts[name].value
+    end
+    class Fact
+        def confine(*_args)
+        end
+        def setcode(&block)
+            @code = block
+        end
+        def value
+            @code.call
+        end
+    end
+    module Util
+        module Resolution
+            def self.exec(_command)
+                $dmidecode
+            end
+        end
+    end
+end
+
+class << File
+    alias_method :real_binread, :binread
+    def binread(name, *args)
+        raise Errno::ENOENT, name if name == '/sys/firmware/dmi/tables/DMI'
+        real_binread(name, *args)
+    end
+end
+'''
+
+# Loads the fact given as ARGV[0], then answers an "address<TAB>date" line at a time.
+# An empty address or date leaves that line out of the dump.
+FACT_DRIVER = '''
+require 'facter'
+load ARGV[0]
+STDIN.each_line do |line|
+    address, date = line.chomp("\\n").split("\\t", -1)
+    $dmidecode = "BIOS Information\\n\\tVendor: Phoenix Technologies LTD\\n\\tVersion: 6.00\\n"
+    $dmidecode += "\\tRelease Date: #{date}\\n" unless date.empty?
+    $dmidecode += "\\tAddress: #{address}\\n" unless address.empty?
+    puts Facter.value('vmware_version').inspect
+end
+'''
+
+# Loads the external fact given as ARGV[1] and answers an "address<TAB>date" line at a time,
+# the way FACT_DRIVER does: the fact reads an SMBIOS table (ARGV[2] 'smbios'), or finds no
+# table and runs the dmidecode stand-in, which prints $VMWARE_FAKE_DMIDECODE (ARGV[2]
+# 'dmidecode').  ARGV[3] is a scratch directory and ARGV[4] this directory.
+PYTHON_FACT_DRIVER = '''
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+sys.path.insert(0, sys.argv[4])
+import synthetic_corpus
+
+spec = importlib.util.spec_from_file_location('vmware_version_fact', sys.argv[1])
+fact = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fact)
+mode, scratch_dir = sys.argv[2], sys.argv[3]
+fact.SYS_VENDOR = os.path.join(scratch_dir, 'sys_vendor')
+with open(fact.SYS_VENDOR, 'w') as vendorfilehandle:
+    vendorfilehandle.write('VMware, Inc.\\n')
+tablefile = os.path.join(scratch_dir, 'DMI')
+for line in sys.stdin:
+    address, date = line.rstrip('\\n').split('\\t')
+    if mode == 'smbios':
+        with open(tablefile, 'wb') as tablefilehandle:
+            tablefilehandle.write(synthetic_corpus.smbios_table({'address': address,
+                                                                 'date': date}))
+    else:
+        dump = 'BIOS Information\\n\\tVendor: Phoenix Technologies LTD\\n\\tVersion: 6.00\\n'
+        dump += f'\\tRelease Date: {date}\\n' if date else ''
+        dump += f'\\tAddress: {address}\\n' if address else ''
+        with open(os.environ['VMWARE_FAKE_DMIDECODE'], 'w') as dumpfilehandle:
+            dumpfilehandle.write(dump)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tablefile)
+    sys.argv = [sys.argv[1], tablefile]
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        fact.main()
+    answer = output.getvalue().rstrip('\\n').partition('=')[2] if output.getvalue() else None
+    print('nil' if answer is None else json.dumps(answer), flush=True)
+'''
+
+FAKE_DMIDECODE = '''#!/bin/sh
+cat "$VMWARE_FAKE_DMIDECODE"
+'''
+
+def guests_to_ask(bioses):
+    '''
+        Every (address, date) in the corpus, each address with a date it wasn't seen with, an
+        unknown address with each date, and dumps missing an address or a date.
+    '''
+    guests = dict.fromkeys((bios['address'], bios['date']) for bios in bioses.values())
+    guests.update(dict.fromkeys((address, UNKNOWN_DATE) for address, _date in list(guests)))
+    guests.update(dict.fromkeys((UNKNOWN_ADDRESS, date) for _address, date in list(guests)))
+    guests.update(dict.fromkeys([('', ''), (UNKNOWN_ADDRESS, ''), ('', UNKNOWN_DATE)]))
+    return list(guests)
+
+def fact_answers(fact_file, guests, ruby_dir):
+    '''
+        What the rendered fact in fact_file answers for each guest, in order.
+    '''
+    stdin = ''.join(f'{address}\t{date}\n' for address, date in guests)
+    completed = subprocess.run(['ruby', '-I', ruby_dir, os.path.join(ruby_dir, 'driver.rb'),
+                                fact_file],
+                               input=stdin, capture_output=True, text=True, check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(f'{fact_file}: ruby exited {completed.returncode}: '
+                           f'{completed.stderr.strip()}')
+    answers = completed.stdout.splitlines()
+    if len(answers) != len(guests):
+        raise RuntimeError(f'{fact_file}: {len(answers)} answers for {len(guests)} guests')
+    return answers
+
+def external_fact_answers(fact_file, mode, guests, workdir):
+    '''
+        What the rendered external fact in fact_file answers for each guest, in order, reading
+        an SMBIOS table (mode 'smbios') or falling back to dmidecode (mode 'dmidecode').
+    '''
+    stdin = ''.join(f'{address}\t{date}\n' for address, date in guests)
+    scratch_dir = os.path.join(workdir, f'external.{mode}')
+    os.makedirs(scratch_dir, exist_ok=True)
+    env = dict(os.environ,
+               PATH=os.pathsep.join([os.path.join(workdir, 'bin'), os.environ.get('PATH', '')]),
+               VMWARE_FAKE_DMIDECODE=os.path.join(scratch_dir, 'dmidecode.out'))
+    completed = subprocess.run([sys.executable, os.path.join(workdir, 'python_driver.py'),
+                                fact_file, mode, scratch_dir, __location__],
+                               input=stdin, capture_output=True, text=True, check=False, env=env)
+    if completed.returncode != 0:
+        raise RuntimeError(f'{fact_file} ({mode}): python exited {completed.returncode}: '
+                           f'{completed.stderr.strip()}')
+    answers = completed.stdout.splitlines()
+    if len(answers) != len(guests):
+        raise RuntimeError(f'{fact_file} ({mode}): {len(answers)} answers for '
+                           f'{len(guests)} guests')
+    return answers
+
+def write_fact(filename, line_order, templatefile):
+    ''' Render templatefile with this mapping into filename. '''
+    with open(filename, 'w') as factfilehandle:
+        for line in render_template(line_order, templatefile):
+            print(line, file=factfilehandle)
+
+def compare_corpus(name, resolver, workdir):
+    '''
+        Render every fact for every variant and compare their answers with the ladder's for
+        every guest.  Returns a list of mismatch descriptions; empty is good.
+    '''
+    guests = guests_to_ask(resolver.bioses)
+    mismatches = []
+    for variant, (minor, round_high) in VARIANTS.items():
+        line_order = resolver.line_order(minor=minor, round_high=round_high)
+        answers = {}
+        for form, templatefile in (('ladder', LADDER_TEMPLATE), ('hash', HASH_TEMPLATE)):
+            fact_file = os.path.join(workdir, f'{form}.rb')
+            write_fact(fact_file, line_order, templatefile)
+            answers[form] = fact_answers(fact_file, guests, workdir)
+        fact_file = os.path.join(workdir, 'vmware_version.py')
+        write_fact(fact_file, line_order, EXTERNAL_TEMPLATE)
+        for mode in ('smbios', 'dmidecode'):
+            answers[f'python {mode}'] = external_fact_answers(fact_file, mode, guests, workdir)
+        for index, (address, date) in enumerate(guests):
+            ladder = answers['ladder'][index]
+            for form, form_answers in answers.items():
+                if form_answers[index] != ladder:
+                    mismatches.append(f'{name}, {variant}: {address or "(no address)"} '
+                                      f'{date or "(no date)"}: ladder {ladder}, '
+                                      f'{form} {form_answers[index]}')
+        print(f'{name}, {variant}: {len(guests)} guests compared', file=sys.stderr)
+    return mismatches
+
+def synthetic_resolver(corpus_dir, num_builds, dump_fraction, seed, updates_per_bios_date):
+    ''' A Resolver over a freshly made-up corpus. '''
+    os.makedirs(corpus_dir)
+    kb_filename, dmidecode_dirname, _count = synthetic_corpus.write_corpus(
+        corpus_dir, num_builds, dump_fraction=dump_fraction, seed=seed,
+        updates_per_bios_date=updates_per_bios_date)
+    json_filename = os.path.join(corpus_dir, 'esxi_build_numbers.json')
+    with open(kb_filename, 'r') as kb_filehandle, open(json_filename, 'w') as json_filehandle:
+        kb_parser.emit_json(kb_parser.interpolate(kb_parser.parse_lines(kb_filehandle)),
+                            json_filehandle)
+    return Resolver.from_files(json_filename, dmidecode_dirname)
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpora',
+                        type=int,
+                        default=DEFAULT_CORPORA,
+                        help=f'How many synthetic corpora to try (default {DEFAULT_CORPORA})')
+    parser.add_argument('--max-builds',
+                        type=int,
+                        default=DEFAULT_MAX_BUILDS,
+                        dest='max_builds',
+                        help='Largest synthetic corpus, in KB rows')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=None,
+                        help='Random seed for the synthetic corpora')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    rng = random.Random(cli_options.seed)
+    with tempfile.TemporaryDirectory(prefix='vmware_fact_equivalence.') as workdir:
+        for filename, contents in (('facter.rb', FACTER_STUB), ('driver.rb', FACT_DRIVER),
+                                   ('python_driver.py', PYTHON_FACT_DRIVER),
+                                   (os.path.join('bin', 'dmidecode'), FAKE_DMIDECODE)):
+            os.makedirs(os.path.dirname(os.path.join(workdir, filename)), exist_ok=True)
+            with open(os.path.join(workdir, filename), 'w') as driverfilehandle:
+                driverfilehandle.write(contents)
+        os.chmod(os.path.join(workdir, 'bin', 'dmidecode'), 0o755)
+        try:
+            mismatches = compare_corpus('real corpus',
+                                        Resolver.from_files(BUILD_NUM_JSON_FILE, DMIDECODE_DIR),
+                                        workdir)
+            for corpus in range(cli_options.corpora):
+                num_builds = rng.randint(len(synthetic_corpus.MAJORS), cli_options.max_builds)
+                dump_fraction = rng.uniform(0.05, 0.9)
+                corpus_seed = rng.randrange(2 ** 32)
+                updates_per_bios_date = rng.choice((1, 2, 3))
+                resolver = synthetic_resolver(os.path.join(workdir, f'synthetic.{corpus}'),
+                                              num_builds, dump_fraction, corpus_seed,
+                                              updates_per_bios_date)
+                mismatches.extend(compare_corpus(
+                    f'synthetic corpus {corpus} ({num_builds} builds, seed {corpus_seed})',
+                    resolver, workdir))
+        except (OSError, RuntimeError) as err:
+            print(err, file=sys.stderr)
+            sys.exit(2)
+
+    for mismatch in mismatches[:50]:
+        print(f'FAIL {mismatch}')
+    if mismatches:
+        print(f'{len(mismatches)} answers differ')
+        sys.exit(1)
+    print('OK')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+'''
+    Read the build table straight out of a saved copy of the VMware KB page (File > Save As on
+    https://kb.vmware.com/kb/2143832), instead of copying it into raw_data_from_KB.txt by hand.
+
+    Each table row comes out as the tab-separated line we'd have pasted, so it goes through
+    parse_lines/match_one_line like any other and the records are the same:
+
+        with open('kb2143832.html', 'r') as htmlfilehandle:
+            emit_json(interpolate(parse_lines(kb_html_lines(htmlfilehandle))), sys.stdout)
+
+    The page is fed to the parser a chunk at a time and rows are handed on as they finish, so
+    only the row being read is ever held, however big the page is.
+
+    gcox@mozilla
+'''
+from html.parser import HTMLParser
+from profiling import PROFILER
+
+CHUNK_SIZE = 64 * 1024
+
+class KBTableParser(HTMLParser):
+    '''
+        Collects the cells of every table row into self.rows, as lists of strings with the
+        whitespace collapsed.  Header rows (any <th>) are dropped.  The caller empties rows
+        as it goes.
+    '''
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._row = None
+        self._cell = None
+        self._header_row = False
+
+    def _close_cell(self):
+        if self._cell is not None and self._row is not None:
+            self._row.append(' '.join(''.join(self._cell).split()))
+        self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row and not self._header_row:
+            self.rows.append(self._row)
+        self._row = None
+        self._header_row = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._close_row()
+            self._row = []
+        elif tag in ('td', 'th'):
+            self._close_cell()
+            if self._row is None:
+                self._row = []
+            self._header_row = self._header_row or tag == 'th'
+            self._cell = []
+        elif tag == 'br' and self._cell is not None:
+            self._cell.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th'):
+            self._close_cell()
+        elif tag in ('tr', 'table'):
+            self._close_row()
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def close(self):
+        super().close()
+        self._close_row()
+
+def row_to_line(row):
+    '''
+        A table row as the line raw_data_from_KB.txt would have: cells joined by tabs, with a
+        space standing in for an empty cell (the KB leaves some release dates out).
+    '''
+    return '\t'.join(cell if cell else ' ' for cell in row) + '\n'
+
+def kb_html_lines(htmlfilehandle, chunk_size=CHUNK_SIZE):
+    '''
+        Yield a raw_data_from_KB.txt-style line for each data row of the tables in the page.
+    '''
+    parser = KBTableParser()
+    while True:
+        chunk = htmlfilehandle.read(chunk_size)
+        if not chunk:
+            break
+        PROFILER.count('html_bytes_read', len(chunk))
+        parser.feed(chunk)
+        for row in parser.rows:
+            yield row_to_line(row)
+        parser.rows.clear()
+    parser.close()
+    for row in parser.rows:
+        yield row_to_line(row)
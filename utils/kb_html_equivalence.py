@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+'''
+    Check that reading the KB out of a saved copy of its web page gives the same JSON, byte for
+    byte, as reading the same rows out of raw_data_from_KB.txt.
+
+    create_esxi_build_numbers_json.py is run both ways, and the page is also fed through
+    kb_html_lines() a few bytes at a time, so rows and tags split across reads get tried.
+
+        ./kb_html_equivalence.py
+        ./kb_html_equivalence.py kb2143832.html raw_data_from_KB.txt
+
+    The default page, fixtures/kb2143832.html, is a stand-in made from raw_data_from_KB.txt with
+    the kinds of markup the real page has (links, spans, <br>s, entities, header rows, script).
+    Exits non-zero if any of the outputs differ.
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import io
+import json
+import subprocess
+from kb_html import kb_html_lines
+from kb_parser import emit_json, interpolate, parse_lines
+
+__location__ = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(__location__, 'create_esxi_build_numbers_json.py')
+DEFAULT_PAGE = os.path.join(__location__, 'fixtures', 'kb2143832.html')
+DEFAULT_KB = os.path.join(__location__, 'raw_data_from_KB.txt')
+# Odd sizes, so reads end in the middle of tags, entities and rows.
+CHUNK_SIZES = (1, 7, 509)
+
+def script_json(args, stdin_filename=None):
+    ''' What create_esxi_build_numbers_json.py prints with these arguments. '''
+    if stdin_filename is None:
+        completed = subprocess.run([SCRIPT] + args, capture_output=True, text=True,
+                                   check=False, stdin=subprocess.DEVNULL)
+    else:
+        with open(stdin_filename, 'r') as stdin_filehandle:
+            completed = subprocess.run([SCRIPT] + args, capture_output=True, text=True,
+                                       check=False, stdin=stdin_filehandle)
+    if completed.returncode != 0 or completed.stderr:
+        raise RuntimeError(f'{" ".join([SCRIPT] + args)}: exited {completed.returncode}: '
+                           f'{completed.stderr.strip()}')
+    return completed.stdout
+
+def chunked_json(page, chunk_size):
+    ''' The JSON from the page, read chunk_size characters at a time. '''
+    with open(page, 'r', errors='replace') as htmlfilehandle:
+        output = io.StringIO()
+        emit_json(interpolate(parse_lines(kb_html_lines(htmlfilehandle, chunk_size))), output)
+    return output.getvalue()
+
+def first_difference(expected, got):
+    ''' The first line where got differs from expected, for the report. '''
+    expected_lines = expected.splitlines()
+    got_lines = got.splitlines()
+    for number, (expected_line, got_line) in enumerate(zip(expected_lines, got_lines), 1):
+        if expected_line != got_line:
+            return f'line {number}: {expected_line!r} != {got_line!r}'
+    return f'{len(expected_lines)} lines != {len(got_lines)} lines'
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('page',
+                        nargs='?',
+                        default=DEFAULT_PAGE,
+                        metavar='PAGE.html',
+                        help='Saved KB page (default: fixtures/kb2143832.html)')
+    parser.add_argument('kbfile',
+                        nargs='?',
+                        default=DEFAULT_KB,
+                        metavar='KB.txt',
+                        help='The same rows, pasted (default: raw_data_from_KB.txt)')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    try:
+        expected = script_json([], stdin_filename=cli_options.kbfile)
+        outputs = [('--html', script_json(['--html', cli_options.page]))]
+        outputs.extend((f'{chunk_size}-character reads', chunked_json(cli_options.page,
+                                                                      chunk_size))
+                       for chunk_size in CHUNK_SIZES)
+    except (OSError, RuntimeError) as err:
+        print(err, file=sys.stderr)
+        sys.exit(2)
+
+    failed = False
+    for name, got in outputs:
+        if got != expected:
+            print(f'FAIL {name}: {first_difference(expected, got)}')
+            failed = True
+    if failed:
+        sys.exit(1)
+    print(f'OK: {len(json.loads(expected))} rows')
+
+if __name__ == '__main__':
+    main()
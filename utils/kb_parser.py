@@ -0,0 +1,148 @@
+'''
+    Parsing for the scrape of the VMware KB in raw_data_from_KB.txt, shared by the scripts
+    that read it.  Everything here is a generator stage, so a pipeline looks like:
+
+        emit_json(interpolate(parse_lines(sys.stdin)), sys.stdout)
+
+    gcox@mozilla
+'''
+import sys
+import re
+import json
+from profiling import PROFILER
+
+fields       = ('osname', 'full_version', 'major_version', 'true_minor_version',
+                'release_date', 'build_number', 'installer_build_number')
+addon_fields = ('interpolated_update_version', 'interpolated_build_number')
+
+BLANK_MATCHER   = re.compile(r'^\s*$')
+COMMENT_MATCHER = re.compile(r'^\s*#')
+# If VMW changes the layout of the KB, this regexp will probably need tweaking.
+# In lieu of an example line for this evil regexp, see raw_data_from_KB.txt
+LINE_MATCHER    = re.compile(r'''
+    ^\s*                          # leading spaces if any
+     (ESX|ESXi|ESXI||ESXi/ESX)\s+ # ESX or ESXi, space
+     ((\d\.\d)                    # Major version number  (doublegrab here, full version and breakout)
+       (?:\s+|\.\d?\s*|\S\s*)     # either spaces, or, .0(optionalspace) to get rid of stupid cases of
+                                  # there being "5.1.0 GA" and "6.0.0b" and "7.0b"
+     (.*?))                       # A grab-it-all for the descriptor of the release.
+     \t                           #   BREAK
+     [^\t]+                       # A release name, which we do not currently use   FIXME
+     \t                           #   BREAK
+     (\s|\d{1,2}/\d{1,2}/\d{4}|\d{4}-\d{2}-\d{2})
+                                  # Release date (if they put one in)
+     \t                           #   BREAK
+     (\d+)                        # Numeric build number
+     \t                           #   BREAK
+     (\S+)                        # Installer build number (though usually an "NA" or "N/A")
+     \s*$                         # trailing spaces if any
+     ''',
+    re.X)
+USA_DATE_MATCHER = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
+UPDATE_MATCHER   = re.compile(r'(?:U|Update )(\d+)')
+BUILD_MATCHER    = re.compile(r'^\d+$')
+
+def match_one_line(line_fields, line):
+    '''
+        Perform regex matching on submitted line.
+        return dict() of mapped info, or string of error
+    '''
+    if BLANK_MATCHER.match(line):
+        # skip empty lines
+        return {}
+    if COMMENT_MATCHER.match(line):
+        # skip comments
+        return {}
+    linematch = LINE_MATCHER.match(line)
+    line = line.rstrip('\r\n')
+    if linematch:
+        PROFILER.count('regex_matches')
+        vals = list(linematch.groups())
+        line_dict = {line_fields[i] : vals[i] for i in range(0, len(vals))}
+        if line_dict['release_date'] in [' ']:
+            line_dict['release_date'] = ''
+        # Fix the date into YYYY-MM-DD
+        datecheck_usa = USA_DATE_MATCHER.match(line_dict['release_date'])
+        if datecheck_usa:
+            line_dict['release_date'] = '{yyyy:04d}-{mm:02d}-{dd:02d}'.format(
+                    yyyy=int(datecheck_usa.group(3)),
+                    mm=int(datecheck_usa.group(1)),
+                    dd=int(datecheck_usa.group(2)))
+        return line_dict
+    PROFILER.count('regex_misses')
+    return 'Could not match "{}"'.format(line)
+
+def print_error(error):
+    ''' Default error handler for parse_lines: complain on stderr and carry on. '''
+    print(error, file=sys.stderr)
+
+def parse_lines(lines, line_fields=fields, on_error=print_error, keep_full_line=False,
+                cache=None):
+    '''
+        For each line, yield a hash of k/v pairs based on the structure of the KB.
+        Comments and blank lines are skipped; lines that don't match go to on_error.
+        With keep_full_line, the original line rides along as 'full_line'.
+        With a BuildCache, lines we've parsed on an earlier run aren't matched again.
+    '''
+    for line in lines:
+        PROFILER.count('bytes_read', len(line))
+        if cache is None:
+            parsed_line = match_one_line(line_fields, line)
+        else:
+            parsed_line = cache.get('kb', line,
+                                    lambda kb_line: match_one_line(line_fields, kb_line),
+                                    parsers=(sys.modules[__name__],))
+        if isinstance(parsed_line, str):
+            # strings are errors
+            on_error(parsed_line)
+            continue
+        if not parsed_line:
+            # comment or blank line, okay to skip.
+            continue
+        if keep_full_line:
+            parsed_line['full_line'] = line.rstrip('\r\n')
+        yield parsed_line
+
+def interpolate(parsed_lines):
+    '''
+        Interpolate a build number and a "well, it's MOSTLY this update version" into variables
+        for simplicity's sake.  Yields the same lines back, in the same (sheet) order.
+
+        The update version has to be worked out from old to new / bottom to top of the KB sheet,
+        so this stage has to see every line before it can hand back the first one.
+    '''
+    parsed_lines = list(parsed_lines)
+    interpolated_update_version = ''
+    major_version_tracker = "-123456"    # just something that doesn't match a real version
+
+    for parsed_line in reversed(parsed_lines):
+        if major_version_tracker != parsed_line['major_version']:
+            major_version_tracker = parsed_line['major_version']
+            interpolated_update_version = ''
+        else:
+            update_match = UPDATE_MATCHER.match(parsed_line['true_minor_version'])
+            if update_match:
+                interpolated_update_version = 'u{}'.format(update_match.group(1))
+        parsed_line['interpolated_update_version'] = interpolated_update_version
+
+        build_match = BUILD_MATCHER.match(parsed_line['installer_build_number'])
+        if build_match:
+            parsed_line['interpolated_build_number'] = parsed_line['installer_build_number']
+        else:
+            parsed_line['interpolated_build_number'] = parsed_line['build_number']
+    yield from parsed_lines
+
+def emit_json(output_lines, outfile):
+    '''
+        The esxi_build_numbers.json format: one pretty-printed list.
+    '''
+    json_text = json.dumps(list(output_lines), ensure_ascii=False, indent=3,
+                           separators=(',', ' : '))
+    print(json_text, file=outfile)
+
+def emit_jsonl(output_lines, outfile):
+    '''
+        One JSON object per line, written as each line comes through.
+    '''
+    for output_line in output_lines:
+        print(json.dumps(output_line, ensure_ascii=False), file=outfile)
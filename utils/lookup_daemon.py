@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+'''
+    A long-running lookup service, for jobs that need answers for a lot of machines and can't
+    afford to start a process (and re-ingest everything) per lookup.
+
+    The mapping is loaded once, and loaded again whenever the build number JSON or anything in
+    the dmidecode directory changes.  Clients connect over a Unix socket or localhost TCP and
+    send one JSON request per line; each gets one JSON line back.
+
+        ./lookup_daemon.py --socket /run/vmware_version.sock
+        ./lookup_daemon.py --port 8765
+
+    A request is a batch of queries, each either a BIOS address and date, or a build number
+    (which resolves to the KB release at or below it, as build_index.py does; add a "major" if
+    you know it, or a build in the range of several majors comes back with no version, and
+    "candidates" for each of them):
+        {"queries": [{"address": "0xEA520", "date": "07/03/2018"}, {"build": "10302608"}],
+         "minor": true, "minor_high": false}
+    and the answer is the queries in the same order, with a version added to each (null where
+    we don't know) or an error:
+        {"results": [{"address": "0xEA520", "date": "07/03/2018", "version": "6.7u1"}, ...]}
+
+    {"stats": true} instead returns request/query/error counts, reloads, and latency.
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import asyncio
+import collections
+import json
+import time
+from bios_resolver import BUILD_NUM_JSON_FILE, DMIDECODE_DIR, Resolver
+from build_index import BuildIndex
+
+__location__ = os.path.dirname(__file__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_RELOAD_INTERVAL = 2.0
+# Latency percentiles are over this many of the most recent requests.
+LATENCY_WINDOW = 10000
+# Longest request line we'll read, in bytes.
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+def source_signature(json_file, dmidecode_dir):
+    '''
+        Something that changes whenever the JSON or any dmidecode file is added, removed or
+        rewritten: their names, sizes and modification times.
+    '''
+    paths = [os.path.join(__location__, json_file)]
+    for root, _dirs, files in os.walk(os.path.join(__location__, dmidecode_dir)):
+        paths.extend(os.path.join(root, file) for file in files)
+    signature = []
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            signature.append((path, None, None))
+            continue
+        signature.append((path, stat.st_size, stat.st_mtime_ns))
+    return signature
+
+class Mapping:
+    '''
+        Everything one load of the sources gives us: a Resolver for addresses and a BuildIndex
+        for build numbers.
+    '''
+    def __init__(self, json_file, dmidecode_dir):
+        self.signature = source_signature(json_file, dmidecode_dir)
+        self.resolver = Resolver.from_files(json_file, dmidecode_dir)
+        self.build_index = BuildIndex.from_json_file(json_file)
+        self.loaded_at = time.time()
+        # Build every lookup table now rather than on some client's first request.
+        for minor in (False, True):
+            for round_high in (False, True):
+                self.resolver.lookup_table(minor=minor, round_high=round_high)
+
+    def answer(self, query, minor=False, round_high=False):
+        '''
+            One query's result: the query itself plus a version, or plus an error.
+        '''
+        if not isinstance(query, dict):
+            return {'error': 'a query must be an object'}
+        result = dict(query)
+        for key in ('address', 'date', 'build', 'major'):
+            value = query.get(key)
+            # A date can be left out (or null); bool is an int, but not a build number.
+            if value is None and key == 'date':
+                continue
+            if key in query and (not isinstance(value, (str, int)) or isinstance(value, bool)):
+                result['error'] = f'{key} must be a string or a number'
+                return result
+        if 'build' in query:
+            buildnum = str(query['build'])
+            if not buildnum.isdigit():
+                result['error'] = 'not a build number'
+                return result
+            if 'major' in query:
+                release = self.build_index.lookup(buildnum, major=str(query['major']))
+                candidates = [release]
+                exact = release is not None and buildnum in (
+                    release['build_number'], release['installer_build_number'])
+            else:
+                resolved = self.build_index.resolve(buildnum)
+                release, candidates, exact = (resolved['release'], resolved['candidates'],
+                                              resolved['exact'])
+            result['version'] = BuildIndex.version(release, minor=minor)
+            result['exact'] = exact
+            if len(candidates) > 1:
+                # Inside several majors' builds: no answer, but here's what each would say.
+                result['candidates'] = [BuildIndex.version(candidate, minor=minor)
+                                        for candidate in candidates]
+        elif 'address' in query:
+            result['version'] = self.resolver.resolve(query['address'], query.get('date'),
+                                                      minor=minor, round_high=round_high)
+        else:
+            result['error'] = 'a query needs an address (and date) or a build'
+        return result
+
+class LookupServer:
+    '''
+        Serves a Mapping to clients, swapping in a new one when the sources change.
+    '''
+    def __init__(self, json_file=BUILD_NUM_JSON_FILE, dmidecode_dir=DMIDECODE_DIR,
+                 reload_interval=DEFAULT_RELOAD_INTERVAL):
+        self.json_file = json_file
+        self.dmidecode_dir = dmidecode_dir
+        self.reload_interval = reload_interval
+        self.mapping = Mapping(json_file, dmidecode_dir)
+        self.failed_signature = None
+        self.started_at = time.time()
+        self.counters = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def stats(self):
+        ''' Counters and latency (in ms) since we started, as a dict ready for JSON. '''
+        latencies = sorted(self.latencies)
+        latency = {'window': len(latencies)}
+        if latencies:
+            latency.update({'mean_ms': sum(latencies) / len(latencies) * 1000,
+                            'p50_ms': latencies[len(latencies) // 2] * 1000,
+                            'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+                            'max_ms': latencies[-1] * 1000})
+        uptime = time.time() - self.started_at
+        return {'uptime': uptime,
+                'loaded_at': self.mapping.loaded_at,
+                'requests': self.counters['requests'],
+                'queries': self.counters['queries'],
+                'errors': self.counters['errors'],
+                'reloads': self.counters['reloads'],
+                'reload_failures': self.counters['reload_failures'],
+                'requests_per_second': self.counters['requests'] / uptime if uptime else 0.0,
+                'latency': latency}
+
+    def handle_request(self, line):
+        ''' One request line in, one response dict out. '''
+        try:
+            request = json.loads(line)
+        except ValueError as err:
+            self.counters['errors'] += 1
+            return {'error': f'bad JSON: {err}'}
+        if isinstance(request, list):
+            request = {'queries': request}
+        if not isinstance(request, dict):
+            self.counters['errors'] += 1
+            return {'error': 'a request must be an object or a list of queries'}
+        if request.get('stats'):
+            return self.stats()
+        queries = request.get('queries')
+        if not isinstance(queries, list):
+            self.counters['errors'] += 1
+            return {'error': 'a request needs a list of queries'}
+        minor = bool(request.get('minor', False))
+        round_high = bool(request.get('minor_high', False))
+        mapping = self.mapping
+        results = [mapping.answer(query, minor=minor, round_high=round_high)
+                   for query in queries]
+        self.counters['queries'] += len(queries)
+        self.counters['errors'] += sum(1 for result in results if 'error' in result)
+        return {'results': results}
+
+    async def handle_client(self, reader, writer):
+        ''' Answer requests from one connection until it closes. '''
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Over MAX_REQUEST_SIZE: there's no telling where the next request starts.
+                    writer.write(b'{"error": "request too large"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                start = time.perf_counter()
+                response = self.handle_request(line)
+                self.counters['requests'] += 1
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                self.latencies.append(time.perf_counter() - start)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def watch_sources(self):
+        '''
+            Poll the sources, and load a new Mapping (off the event loop, so lookups carry on
+            against the old one meanwhile) whenever they change.  A failed load keeps the old one,
+            and isn't retried until the sources change again.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            signature = await loop.run_in_executor(None, source_signature, self.json_file,
+                                                   self.dmidecode_dir)
+            if signature in (self.mapping.signature, self.failed_signature):
+                continue
+            try:
+                self.mapping = await loop.run_in_executor(None, Mapping, self.json_file,
+                                                          self.dmidecode_dir)
+            # A half-written file can fail in any number of ways; we'll try again next time.
+            except Exception as err:  # pylint: disable=broad-except
+                self.failed_signature = signature
+                self.counters['reload_failures'] += 1
+                print(f'reload failed, keeping the old mapping: {err}', file=sys.stderr)
+                continue
+            self.counters['reloads'] += 1
+            print(f'reloaded mapping: {len(self.mapping.resolver.bioses)} dmidecode files',
+                  file=sys.stderr)
+
+    async def serve(self, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        ''' Listen until cancelled. '''
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = await asyncio.start_unix_server(self.handle_client, path=socket_path,
+                                                     limit=MAX_REQUEST_SIZE)
+        else:
+            server = await asyncio.start_server(self.handle_client, host=host, port=port,
+                                                limit=MAX_REQUEST_SIZE)
+        watcher = asyncio.create_task(self.watch_sources())
+        print(f'listening on {socket_path or f"{host}:{port}"}', file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            if socket_path is not None and os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket',
+                        dest='socket_path',
+                        metavar='PATH',
+                        help='Listen on a Unix socket at <PATH> instead of TCP')
+    parser.add_argument('--host',
+                        default=DEFAULT_HOST,
+                        help=f'TCP address to listen on (default {DEFAULT_HOST})')
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help=f'TCP port to listen on (default {DEFAULT_PORT})')
+    parser.add_argument('--reload-interval',
+                        type=float,
+                        default=DEFAULT_RELOAD_INTERVAL,
+                        dest='reload_interval',
+                        metavar='SECONDS',
+                        help='How often to check the sources for changes')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    server = LookupServer(BUILD_NUM_JSON_FILE, DMIDECODE_DIR,
+                          reload_interval=cli_options.reload_interval)
+    try:
+        asyncio.run(server.serve(socket_path=cli_options.socket_path, host=cli_options.host,
+                                 port=cli_options.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+'''
+    Load generator for lookup_daemon.py: how many requests per second does it answer?
+
+    Opens --connections clients, each sending --requests requests of --batch queries, one after
+    the other, and reports requests and queries per second and client-side latency as JSON.
+    Queries are drawn from the real mapping (every known address/date and build number), with
+    some unknown ones mixed in, so the misses get exercised too.
+
+        ./lookup_daemon.py --socket /tmp/vmv.sock &
+        ./lookup_loadgen.py --socket /tmp/vmv.sock --connections 8 --requests 2000 --batch 50
+
+    gcox@mozilla
+'''
+import sys
+import argparse
+import asyncio
+import json
+import random
+import time
+from bios_resolver import BUILD_NUM_JSON_FILE, DMIDECODE_DIR, ingest_dmidecode_files, ingest_json
+from lookup_daemon import DEFAULT_HOST, DEFAULT_PORT, MAX_REQUEST_SIZE
+
+def query_pool():
+    '''
+        Every address/date and build number we know of, plus a few we don't.
+    '''
+    queries = [{'address': bios['address'], 'date': bios['date']}
+               for bios in ingest_dmidecode_files(DMIDECODE_DIR).values()]
+    queries.extend({'build': buildnum} for buildnum in ingest_json(BUILD_NUM_JSON_FILE))
+    queries.append({'address': '0x00000', 'date': '01/01/1970'})
+    queries.append({'build': '1'})
+    return queries
+
+async def open_connection(options):
+    ''' A reader/writer pair to the daemon. '''
+    if options.socket_path:
+        return await asyncio.open_unix_connection(options.socket_path, limit=MAX_REQUEST_SIZE)
+    return await asyncio.open_connection(options.host, options.port, limit=MAX_REQUEST_SIZE)
+
+async def client(options, queries, seed, latencies):
+    ''' One connection's worth of requests; appends each round trip to latencies. '''
+    rng = random.Random(seed)
+    reader, writer = await open_connection(options)
+    try:
+        for _ in range(options.requests):
+            request = {'queries': [rng.choice(queries) for _ in range(options.batch)],
+                       'minor': options.minor_version}
+            start = time.perf_counter()
+            writer.write(json.dumps(request).encode('utf-8') + b'\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if 'results' not in response:
+                raise RuntimeError(f'daemon said: {response}')
+    finally:
+        writer.close()
+
+async def server_stats(options):
+    ''' The daemon's own stats. '''
+    reader, writer = await open_connection(options)
+    try:
+        writer.write(b'{"stats": true}\n')
+        await writer.drain()
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+
+async def run_load(options):
+    ''' All the clients at once; returns the report dict. '''
+    queries = query_pool()
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(options, queries, options.seed + connection, latencies)
+                           for connection in range(options.connections)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    requests = len(latencies)
+    return {'connections': options.connections,
+            'requests': requests,
+            'batch': options.batch,
+            'elapsed': elapsed,
+            'requests_per_second': requests / elapsed,
+            'queries_per_second': requests * options.batch / elapsed,
+            'latency': {'p50_ms': latencies[requests // 2] * 1000,
+                        'p99_ms': latencies[int(requests * 0.99)] * 1000,
+                        'max_ms': latencies[-1] * 1000},
+            'server': await server_stats(options)}
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket',
+                        dest='socket_path',
+                        metavar='PATH',
+                        help='Connect to a Unix socket at <PATH> instead of TCP')
+    parser.add_argument('--host',
+                        default=DEFAULT_HOST,
+                        help=f'TCP address to connect to (default {DEFAULT_HOST})')
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help=f'TCP port to connect to (default {DEFAULT_PORT})')
+    parser.add_argument('--connections',
+                        type=int,
+                        default=4,
+                        help='Concurrent client connections')
+    parser.add_argument('--requests',
+                        type=int,
+                        default=1000,
+                        help='Requests per connection')
+    parser.add_argument('--batch',
+                        type=int,
+                        default=10,
+                        help='Queries per request')
+    parser.add_argument('--minor',
+                        action='store_true',
+                        default=False,
+                        dest='minor_version',
+                        help='Ask for minor versions')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for picking queries')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    try:
+        report = asyncio.run(run_load(cli_options))
+    except (OSError, RuntimeError) as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(report, indent=3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+'''
+    What changed between two KB scrapes, or two generations of the mapping, without
+    regenerating everything and eyeballing the git diff.
+
+    Either input can be a build numbers JSON (esxi_build_numbers.json) or a plain mapping, as
+    printed by matchup_bios_to_string.py (--dump or not) or written by render_variants.py.
+    Both sides are indexed by key (OS and build number for JSON, as ESX and ESXi rows can share
+    an installer build; the build number for a mapping) and walked once, so a diff is linear in
+    their size.  Reported are:
+        added / removed     builds only on one side
+        remapped            builds on both sides with different details
+        moved               the fewest builds that have to move to put the order right
+        answer              every BIOS (address and date) a guest would now get a different
+                            answer for, worked out against the dmidecode corpus for JSON
+                            inputs, and from the mapping itself otherwise
+
+        ./mapping_diff.py diff old/esxi_build_numbers.json ../build_numbers/esxi_build_numbers.json
+        ./mapping_diff.py diff --format jsonl old.json new.json > delta.jsonl
+        ./mapping_diff.py apply old.json delta.jsonl > new.json
+
+    apply rebuilds the new side from the old one and the delta alone, byte for byte, so a
+    refresh only has to ship (and look at) what changed.
+
+    gcox@mozilla
+'''
+import sys
+import argparse
+import bisect
+import json
+from bios_resolver import (DMIDECODE_DIR, Resolver, address_lookup_table, index_builds,
+                           ingest_dmidecode_files)
+from kb_parser import emit_json
+from matchup_bios_to_string import render_text
+
+MAPPING_FIELDS = ('address', 'date', 'buildnum', 'version')
+
+def read_snapshot(filename):
+    '''
+        ('json', list of releases) or ('mapping', list of address/date/buildnum/version dicts).
+    '''
+    with open(filename, 'r') as snapshotfilehandle:
+        contents = snapshotfilehandle.read()
+    if contents.lstrip().startswith('['):
+        return 'json', json.loads(contents)
+    records = []
+    for line in contents.splitlines():
+        if not line.strip():
+            continue
+        values = line.split()
+        if len(values) != len(MAPPING_FIELDS):
+            raise ValueError(f'{filename}: not a mapping line: {line!r}')
+        records.append(dict(zip(MAPPING_FIELDS, values)))
+    return 'mapping', records
+
+def record_key(kind, record):
+    ''' What a record is known by: 'ESXi 10302608' for a KB row, or the mapping's build number. '''
+    if kind == 'json':
+        return f'{record["osname"]} {record["build_number"]}'
+    return record['buildnum']
+
+def index_records(kind, records):
+    '''
+        key -> (position, record), refusing duplicate keys, which would make the diff ambiguous.
+    '''
+    index = {}
+    for position, record in enumerate(records):
+        key = record_key(kind, record)
+        if key in index:
+            raise ValueError(f'build {key} appears more than once')
+        index[key] = (position, record)
+    return index
+
+def guest_line_order(kind, records, bioses, minor, round_high):
+    '''
+        The address/date/buildnum/version lines a fact generated from this side would be built
+        from.  Dumps of builds this side doesn't know (yet, or any more) can't place anything,
+        so they're left out.
+    '''
+    if kind == 'json':
+        builds = index_builds(records)
+        known_bioses = {buildnum: bios for buildnum, bios in bioses.items() if buildnum in builds}
+        return Resolver(builds, known_bioses).line_order(minor=minor, round_high=round_high)
+    return records
+
+def lookup(table, address, date):
+    ''' What a fact with this lookup table answers a guest with, or None. '''
+    version = table.get(address)
+    if version is None:
+        version = table.get((address, date))
+    return version
+
+def longest_increasing_run(items, rank):
+    '''
+        The longest subsequence of items whose ranks increase (patience sorting, n log n).
+    '''
+    tails = []          # tails[length - 1]: index of the smallest tail of a run that long
+    previous = [None] * len(items)
+    tail_ranks = []
+    for index, item in enumerate(items):
+        item_rank = rank(item)
+        length = bisect.bisect_left(tail_ranks, item_rank)
+        if length:
+            previous[index] = tails[length - 1]
+        if length == len(tails):
+            tails.append(index)
+            tail_ranks.append(item_rank)
+        else:
+            tails[length] = index
+            tail_ranks[length] = item_rank
+    run = []
+    index = tails[-1] if tails else None
+    while index is not None:
+        run.append(items[index])
+        index = previous[index]
+    return run[::-1]
+
+def diff_records(kind, old_records, new_records):
+    '''
+        Yield a change record for every build added, removed, remapped or moved from old to new.
+    '''
+    old_index = index_records(kind, old_records)
+    new_index = index_records(kind, new_records)
+    for key, (_position, record) in old_index.items():
+        if key not in new_index:
+            yield {'change': 'removed', 'key': key, 'old': record}
+    for key, (position, record) in new_index.items():
+        if key not in old_index:
+            yield {'change': 'added', 'key': key, 'position': position, 'new': record}
+        elif old_index[key][1] != record:
+            yield {'change': 'remapped', 'key': key, 'position': position,
+                   'old': old_index[key][1], 'new': record}
+    # Builds on both sides normally keep their order.  Where they don't, the most of them that
+    # still are in order stay put, and only the rest are moved (so that apply can put them back):
+    # one build moving is one move, not a move for everything it jumped over.
+    common_old = [key for key in old_index if key in new_index]
+    in_order = set(longest_increasing_run(common_old, lambda key: new_index[key][0]))
+    for key in common_old:
+        if key not in in_order:
+            yield {'change': 'moved', 'key': key, 'position': new_index[key][0],
+                   'new': new_index[key][1]}
+
+def diff_answers(old_line_order, new_line_order):
+    '''
+        Yield a change record for every guest BIOS (address and date) either side knows of,
+        that the two sides' facts would answer differently (None for no answer).
+    '''
+    old_table = address_lookup_table(old_line_order)
+    new_table = address_lookup_table(new_line_order)
+    guests = dict.fromkeys((line['address'], line['date'])
+                           for line_order in (old_line_order, new_line_order)
+                           for line in line_order)
+    for address, date in guests:
+        old_version = lookup(old_table, address, date)
+        new_version = lookup(new_table, address, date)
+        if old_version != new_version:
+            yield {'change': 'answer', 'key': (address, date), 'old': old_version,
+                   'new': new_version}
+
+def diff_snapshots(old_filename, new_filename, dmidecode_dir=DMIDECODE_DIR, minor=False,
+                   round_high=False):
+    '''
+        Everything that changed from old_filename to new_filename, as a stream of change
+        records: builds first, then guest answers.
+    '''
+    old_kind, old_records = read_snapshot(old_filename)
+    new_kind, new_records = read_snapshot(new_filename)
+    if old_kind != new_kind:
+        raise ValueError(f'cannot diff a {old_kind} against a {new_kind}')
+    yield from diff_records(old_kind, old_records, new_records)
+    bioses = ingest_dmidecode_files(dmidecode_dir) if old_kind == 'json' else None
+    yield from diff_answers(guest_line_order(old_kind, old_records, bioses, minor, round_high),
+                            guest_line_order(new_kind, new_records, bioses, minor, round_high))
+
+def apply_delta(kind, base_records, changes):
+    '''
+        The new side's records, from the old side's and the build changes between them.
+        Answer changes follow from the records, so they're skipped.
+    '''
+    dropped = set()
+    replaced = {}
+    inserts = []
+    for change in changes:
+        if change['change'] == 'removed':
+            dropped.add(change['key'])
+        elif change['change'] == 'remapped':
+            replaced[change['key']] = change['new']
+        elif change['change'] in ('added', 'moved'):
+            if change['change'] == 'moved':
+                dropped.add(change['key'])
+            inserts.append((change['position'], change['new']))
+    kept = (replaced.get(record_key(kind, record), record) for record in base_records
+            if record_key(kind, record) not in dropped)
+    # Everything kept is in order already: merge the inserts in at their positions.
+    inserts.sort(key=lambda insert: insert[0])
+    records = []
+    for position, record in inserts:
+        while len(records) < position:
+            records.append(next(kept))
+        records.append(record)
+    records.extend(kept)
+    return records
+
+def json_key(key):
+    ''' A key as JSON can carry it: an answer's (address, date) becomes a list. '''
+    return list(key) if isinstance(key, tuple) else key
+
+def describe(change):
+    ''' One change record as a line for a human. '''
+    key = change['key']
+    if change['change'] == 'answer':
+        return f'answer   {" ".join(key)}: {change["old"]} -> {change["new"]}'
+    old, new = change.get('old'), change.get('new')
+    if change['change'] == 'remapped':
+        fields = sorted(field for field in set(old) | set(new) if old.get(field) != new.get(field))
+        details = ', '.join(f'{field} {old.get(field)} -> {new.get(field)}' for field in fields)
+        return f'remapped {key}: {details}'
+    record = new if new is not None else old
+    summary = record.get('full_version') or f'{record.get("address")} {record.get("version")}'
+    return f'{change["change"]:<8} {key}: {summary}'
+
+def write_changes(changes, output_format, outfile):
+    '''
+        Stream the changes out: a line each (text or JSONL), or one JSON document.
+        Returns how many there were.
+    '''
+    count = 0
+    if output_format == 'json':
+        changes = [dict(change, key=json_key(change['key'])) for change in changes]
+        print(json.dumps(changes, indent=3), file=outfile)
+        return len(changes)
+    for change in changes:
+        if output_format == 'jsonl':
+            print(json.dumps(dict(change, key=json_key(change['key']))), file=outfile)
+        else:
+            print(describe(change), file=outfile)
+        count += 1
+    return count
+
+def read_delta(filename):
+    ''' Change records back out of a JSONL delta. '''
+    with open(filename, 'r') as deltafilehandle:
+        for line in deltafilehandle:
+            if line.strip():
+                yield json.loads(line)
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    diff_parser = subparsers.add_parser('diff', help='What changed from OLD to NEW')
+    diff_parser.add_argument('--format',
+                             choices=('text', 'json', 'jsonl'),
+                             default='text',
+                             dest='output_format',
+                             help='Output format (default text); jsonl is what apply reads')
+    diff_parser.add_argument('--minor',
+                             action='store_true',
+                             default=False,
+                             dest='minor_version',
+                             help='Compare minor-version answers (JSON inputs)')
+    diff_parser.add_argument('--minor-error-high',
+                             action='store_true',
+                             default=False,
+                             dest='minor_high',
+                             help='Compare answers rounded high (JSON inputs)')
+    diff_parser.add_argument('--dmidecode-dir',
+                             default=DMIDECODE_DIR,
+                             dest='dmidecode_dir',
+                             metavar='DIR',
+                             help='dmidecode corpus to work out answers with (JSON inputs)')
+    diff_parser.add_argument('old', metavar='OLD')
+    diff_parser.add_argument('new', metavar='NEW')
+    apply_parser = subparsers.add_parser('apply', help='Rebuild NEW from OLD and a JSONL delta')
+    apply_parser.add_argument('old', metavar='OLD')
+    apply_parser.add_argument('delta', metavar='DELTA')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    try:
+        if cli_options.command == 'diff':
+            changes = diff_snapshots(cli_options.old, cli_options.new,
+                                     dmidecode_dir=cli_options.dmidecode_dir,
+                                     minor=cli_options.minor_version,
+                                     round_high=cli_options.minor_high)
+            count = write_changes(changes, cli_options.output_format, sys.stdout)
+            print(f'{count} changes', file=sys.stderr)
+        else:
+            kind, base_records = read_snapshot(cli_options.old)
+            records = apply_delta(kind, base_records, read_delta(cli_options.delta))
+            if kind == 'json':
+                emit_json(records, sys.stdout)
+            else:
+                for line in render_text(records):
+                    print(line)
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
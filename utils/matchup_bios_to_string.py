@@ -2,147 +2,70 @@
 '''
     gcox@mozilla
 '''
-import os
 import sys
 import re
 import argparse
-import json
-
-# paths relative to this script:
-BUILD_NUM_JSON_FILE = '../build_numbers/esxi_build_numbers.json'
-DMIDECODE_DIR       = '../dmidecode'
-
-__location__ = os.path.dirname(__file__)
-
-def ingest_json(filename):
+import hashlib
+from build_cache import BuildCache
+from profiling import PROFILER, add_profile_arguments, profiled
+# The ingest/matching functions used to live here; they're re-exported for anyone importing them.
+from bios_resolver import (BUILD_NUM_JSON_FILE, DMIDECODE_DIR, Resolver,  # pylint: disable=unused-import
+                           address_lookup_table, all_possible_builds, ingest_dmidecode_files,
+                           ingest_json, version_matching)
+
+def render_hash_lines(line_order):
     '''
-        Read in our JSON of VMware's build numbers, and build a hash of
-            build number -> version number
-        This is pretty much rendering our own 'pretty' version of the VMware KB.
+        Render the lookup table as the entries of a ruby hash literal.
     '''
-    fullpath = os.path.join(__location__, filename)
-    with open(fullpath, 'r') as jsonfilehandle:
-        data = jsonfilehandle.read()
-    build_num_json = json.loads(data)
-
-    all_builds = dict()
-    for build_ref in build_num_json:
-        for attr in ['build_number', 'installer_build_number']:
-            try:
-                int(build_ref[attr])
-            except ValueError:
-                continue
-            buildnum = build_ref[attr]
-            major_version = build_ref['major_version']
-            minor_version = build_ref['major_version'] + build_ref['interpolated_update_version']
-
-            all_builds[buildnum] = {'major': major_version,
-                                    'minor': minor_version}
-    return all_builds
+    flattened_lines = []
+    for key, version in address_lookup_table(line_order).items():
+        if isinstance(key, tuple):
+            flattened_lines.append(f"['{key[0]}', '{key[1]}'] => '{version}',")
+        else:
+            flattened_lines.append(f"'{key}' => '{version}',")
+    return flattened_lines
 
-def ingest_dmidecode_files(dirname):
+def render_dict_lines(line_order):
     '''
-        This is a search over our dmidecode directory, and from that we build a dict of
-            build number -> BIOS Address and Dates
+        Render the lookup table as the entries of a python dict literal.
     '''
-    all_bios = dict()
-    for root, _dirs, files in os.walk(dirname):
-        for file in files:
-            filenamematch = re.match(r'^dmidecode\.(\d+)\.txt$', file)
-            if not filenamematch:
-                continue
-            buildnum = filenamematch.group(1)
-            filepath = os.path.join(root, file)
-            with open(filepath, 'r') as dmidecode_filehandle:
-                filecontents = dmidecode_filehandle.read()
-            addressmatch = re.search(r'^\s*Address:\s+(0x[0-9A-F]{5})\s*$',
-                                    filecontents, re.MULTILINE)
-            address = addressmatch.group(1)
-            datematch = re.search(r'^\s*Release\s+Date:\s+(\d{2}/\d{2}/\d{4})\s*$',
-                                 filecontents, re.MULTILINE)
-            date = datematch.group(1)
-            all_bios[buildnum] = {'address': address, 'date': date}
-    return all_bios
+    flattened_lines = []
+    for key, version in address_lookup_table(line_order).items():
+        if isinstance(key, tuple):
+            flattened_lines.append(f"('{key[0]}', '{key[1]}'): '{version}',")
+        else:
+            flattened_lines.append(f"'{key}': '{version}',")
+    return flattened_lines
 
-def all_possible_builds(bioses, builds, options):
+def mapping_version(line_order, template_lines=()):
     '''
-        Search all of our BIOS dumps and connect them to the build sheet from VMware.
-        The result here is a hash of
-            biosaddress -> date -> version
-        This is a sort of 'reverse hash'.  Each ESX version has a BIOS version, but each
-        BIOS version can happen in multiple ESX versions.  We build that latter mapping
-        so we can match everyone up later.
+        A short digest of the lookup table and the template the fact is rendered from, so a
+        cached answer can tell which mapping, and which version of the fact's logic, it came from.
     '''
-    possible_builds = {}
-
-    if options.minor_version:
-        version_attr = 'minor'
-    else:
-        version_attr = 'major'
-    for buildnum, values in bioses.items():
-        address = values['address']
-        date = values['date']
-        version = builds[buildnum][version_attr]
-
-        possible_builds.setdefault(address, {}).setdefault(date, {}).setdefault(version, True)
-    return possible_builds
-
-def version_matching(bioses, builds, possibuilds, options):
+    digest = hashlib.sha256('\n'.join(render_hash_lines(line_order)).encode('utf-8'))
+    for line in template_lines:
+        digest.update(line.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def ruby_string(value):
+    ''' value as a ruby literal: a single-quoted string, or nil for None '''
+    if value is None:
+        return 'nil'
+    escaped = value.replace('\\', '\\\\').replace("'", "\\'")
+    return f"'{escaped}'"
+
+def render_text(line_order):
     '''
-        At this point, you have
-            BIOSes:  buildnum -> (BIOS address and date)
-            VMware:  buildnum -> (version)
-
-        Here we flatten the bios list down to unique combinations of address(+date) -> version
-        This uses the build number as the glue, but then gets the build number out of the way
-        since it has no meaning in the final results.
-
-        The 'weird' part in here is, a BIOS address can appear in multiple ESXi version.
-        So part of what we do in here is squish down to a single answer: address X is ESXi Y.
-        We hedge low or high based on the minor_high option.
+        The plain mapping, one line per address/date/buildnum/version.
     '''
-    if options.minor_version:
-        version_attr = 'minor'
-    else:
-        version_attr = 'major'
-
-    last = {'address': '', 'date': '', 'version': ''}
-    line_order = []
-
-    for buildnum, values in sorted(bioses.items(), key = lambda kv: (builds[kv[0]]['minor'], kv)):
-        address = values['address']
-        date    = values['date']
-        version = builds[buildnum][version_attr]
-
-        # This section truncates dupes, so bypass it if we're going to dump everything:
-        if not options.dump:
-            # Since the only inputs we have are the address and date, we have to cheat here.
-            # Find the desired output version (round low or high) and go straight there.
-            possible_versions = sorted(possibuilds[address][date].keys())
-
-            if not options.minor_high:
-                possible_versions.reverse()
-            version = possible_versions[0]
-            # Now that we've rounded $version, check if we've seen it before.
-            if (last['address'] == address) and (last['version'] == version):
-                continue
-            last['address'] = address
-            last['date'] = date
-            last['version'] = version
+    return [f'{line["address"]} {line["date"]} {line["buildnum"]} {line["version"]}'
+            for line in line_order]
 
-        line_order.append({'address': address, 'date': date,
-                           'buildnum': buildnum, 'version': version})
-    return line_order
-
-def render_output(line_order, options):
+def render_template(line_order, templatefile, fact_cache=None, template_name=None):
     '''
-        Print the output, either as lines or as a templated puppet fact
+        The lines of a templated puppet fact.  template_name is what the generated header says
+        it came from (templatefile, by default).
     '''
-    if not options.templatefile:
-        for line in line_order:
-            print(f'{line["address"]} {line["date"]} {line["buildnum"]} {line["version"]}')
-        sys.exit(0)
-
     addresses_considered = dict()
     for line in line_order:
         addresses_considered.setdefault(line["address"], {}
@@ -160,19 +83,50 @@ def render_output(line_order, options):
             flattened_lines.append(f"elsif biosaddress == '{address}'")
         flattened_lines.append(f"    vmversion = '{version}'")
 
-    with open(options.templatefile, 'r') as templatefilehandle:
+    with open(templatefile, 'r') as templatefilehandle:
         unparsed_template = templatefilehandle.readlines()
-    print(f"# This file was generated from {options.templatefile}")
-    print('')
+    PROFILER.count('files_opened')
+    PROFILER.count('bytes_read', sum(len(line) for line in unparsed_template))
+    rendered = [f"# This file was generated from {template_name or templatefile}", '']
+    # An executable template's #! line has to stay the first line.
+    if unparsed_template and unparsed_template[0].startswith('#!'):
+        rendered.insert(0, unparsed_template.pop(0).rstrip('\r\n'))
+    # [PLACEHOLDER] becomes an elsif ladder, [PLACEHOLDER_HASH] becomes the entries of a ruby
+    # hash and [PLACEHOLDER_DICT] the entries of a python dict.
+    placeholders = {'PLACEHOLDER': flattened_lines,
+                    'PLACEHOLDER_HASH': render_hash_lines(line_order),
+                    'PLACEHOLDER_DICT': render_dict_lines(line_order)}
+    # These are swapped in wherever they appear in a line.
+    inline_placeholders = {'[PLACEHOLDER_MAPPING_VERSION]': mapping_version(line_order,
+                                                                            unparsed_template),
+                           '[PLACEHOLDER_FACT_CACHE]': ruby_string(fact_cache)}
     for line in unparsed_template:
         line = line.rstrip('\r\n')
-        placeholder_matching = re.match(r'^(\s*)\[PLACEHOLDER\].*$', line)
+        for placeholder, value in inline_placeholders.items():
+            line = line.replace(placeholder, value)
+        placeholder_matching = re.match(r'^(\s*)\[(PLACEHOLDER(?:_HASH|_DICT)?)\].*$', line)
         if not placeholder_matching:
-            print(line)
+            rendered.append(line)
             continue
         spacing = placeholder_matching.group(1)
-        for subline in flattened_lines:
-            print(f'{spacing}{subline}')
+        for subline in placeholders[placeholder_matching.group(2)]:
+            rendered.append(f'{spacing}{subline}')
+    return rendered
+
+def render_output(line_order, options):
+    '''
+        Print the output, either as lines or as a templated puppet fact
+    '''
+    if not options.templatefile:
+        with PROFILER.stage('render'):
+            for line in render_text(line_order):
+                print(line)
+        sys.exit(0)
+
+    with PROFILER.stage('render'):
+        for line in render_template(line_order, options.templatefile,
+                                    getattr(options, 'fact_cache', None)):
+            print(line)
 
 
 def main(prog_args=None):
@@ -206,18 +160,37 @@ def main(prog_args=None):
                         help='Dump all possible BIOS/versions')
 
     # When present, templatefile is a template file of ruby that substitutes [PLACEHOLDER] for
-    # a set of if-then's to find your ESXi version.
+    # a set of if-then's to find your ESXi version, or [PLACEHOLDER_HASH] for the entries of a
+    # hash keyed by address (or [address, date], where an address alone is ambiguous).
     parser.add_argument('--template',
                         dest='templatefile',
                         metavar='FILE',
                         help='use <FILE> and substitute our versioning into the [PLACEHOLDER] area')
+    # Have the generated fact remember its answer in FILE until the next reboot (or until the
+    # mapping or template it was generated from changes).  Without this, the fact works it out
+    # every run.
+    parser.add_argument('--fact-cache',
+                        dest='fact_cache',
+                        metavar='FILE',
+                        help='generated fact caches its answer in <FILE> for the current boot')
+    # Keep the address/date pulled out of each dmidecode file in FILE, keyed by its contents.
+    parser.add_argument('--cache',
+                        dest='cachefile',
+                        metavar='FILE',
+                        help='cache parse results in <FILE> between runs')
+    add_profile_arguments(parser)
     cli_options = parser.parse_args(prog_args[1:])
 
-    all_builds = ingest_json(BUILD_NUM_JSON_FILE)
-    all_bioses = ingest_dmidecode_files(DMIDECODE_DIR)
-    possible_builds = all_possible_builds(all_bioses, all_builds, cli_options)
-    version_matchup = version_matching(all_bioses, all_builds, possible_builds, cli_options)
-    render_output(version_matchup, cli_options)
+    with profiled(cli_options):
+        cache = BuildCache(cli_options.cachefile) if cli_options.cachefile else None
+        resolver = Resolver.from_files(BUILD_NUM_JSON_FILE, DMIDECODE_DIR, cache=cache)
+        if cache is not None:
+            cache.save()
+            cache.report()
+        version_matchup = resolver.line_order(minor=cli_options.minor_version,
+                                              round_high=cli_options.minor_high,
+                                              dump=cli_options.dump)
+        render_output(version_matchup, cli_options)
 
 if __name__ == '__main__':
     main()
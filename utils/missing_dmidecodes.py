@@ -5,137 +5,260 @@
     well, whatever we want.  It's a basis for making a map for a puppet fact, in our case, but the
     JSON itself might have use for others.
 
+    With --coverage, instead of the marked-up sheet you get a coverage report: per major and
+    (interpolated) update version, which releases we have a dmidecode for; the runs of releases
+    between dumps where the BIOS changed somewhere we can't see; and which builds would be the
+    most useful to go and capture next.  --format json for the same thing as JSON.
+
+        ./missing_dmidecodes.py --coverage < raw_data_from_KB.txt
+
     gcox@mozilla
 '''
 import os
 import sys
 import re
+import argparse
+import json
+from bios_resolver import ingest_dmidecode_files
+from build_cache import BuildCache
+from kb_parser import interpolate, parse_lines
+from profiling import PROFILER, add_profile_arguments, profiled
 
 # paths relative to this script:
 DMIDECODE_DIR       = '../dmidecode'
+# How many builds --coverage suggests capturing, by default.
+DEFAULT_TOP = 20
 
-fields       = ('osname', 'full_version', 'major_version', 'true_minor_version',
-                'release_date', 'build_number', 'installer_build_number')
-addon_fields = ('interpolated_update_version', 'interpolated_build_number')
-
-__location__ = os.path.dirname(__file__)
-
-def match_one_line(line_fields, line):
-    '''
-        Perform regex matching on submitted line.
-        return dict() of mapped info, or string of error
-    '''
-    if re.match(r'^\s*$', line):
-        # skip empty lines
-        return {}
-    if re.match(r'^\s*#', line):
-        # skip comments
-        return {}
-    linematcher = re.compile(r'''
-    ^\s*                          # leading spaces if any
-     (ESX|ESXi|ESXI||ESXi/ESX)\s+ # ESX or ESXi, space
-     ((\d\.\d)                    # Major version number  (doublegrab here, full version and breakout)
-       (?:\s+|\.\d?\s*|\S\s*)     # either spaces, or, .0(optionalspace) to get rid of stupid cases of
-                                  # there being "5.1.0 GA" and "6.0.0b" and "7.0b"
-     (.*?))                       # A grab-it-all for the descriptor of the release.
-     \t                           #   BREAK
-     [^\t]+                       # A release name, which we do not currently use   FIXME
-     \t                           #   BREAK
-     (\s|\d{1,2}/\d{1,2}/\d{4}|\d{4}-\d{2}-\d{2})
-                                  # Release date (if they put one in)
-     \t                           #   BREAK
-     (\d+)                        # Numeric build number
-     \t                           #   BREAK
-     (\S+)                        # Installer build number (though usually an "NA" or "N/A")
-     \s*$                         # trailing spaces if any
-     ''',
-    re.X)
-    # If VMW changes the layout of the KB, this regexp will probably need tweaking.
-    # In lieu of an example line for this evil regexp, see raw_data_from_KB.txt
-    linematch = linematcher.match(line)
-    line = line.rstrip('\r\n')
-    if linematch:
-        vals = list(linematch.groups())
-        line_dict = {line_fields[i] : vals[i] for i in range(0, len(vals))}
-        if line_dict['release_date'] in [' ']:
-            line_dict['release_date'] = ''
-        # Fix the date into YYYY-MM-DD
-        datecheck_usa = re.match(r'(\d{1,2})/(\d{1,2})/(\d{4})', line_dict['release_date'])
-        if datecheck_usa:
-            line_dict['release_date'] = '{yyyy:04d}-{mm:02d}-{dd:02d}'.format(
-                    yyyy=int(datecheck_usa.group(3)),
-                    mm=int(datecheck_usa.group(1)),
-                    dd=int(datecheck_usa.group(2)))
-        line_dict['full_line'] = line
-        return line_dict
-    return 'Could not match "{}"'.format(line)
+__location__ = os.path.dirname(os.path.abspath(__file__))
 
 def list_dmidecode_files(dirname):
     '''
-        This is a search over our dmidecode directory, and from that we build a list of
+        This is a search over our dmidecode directory, and from that we build a set of
             build numbers
     '''
-    all_bios = list()
+    all_bios = set()
     for _root, _dirs, files in os.walk(dirname):
         for file in files:
-            filenamematch = re.match(r'^dmidecode\.(\d+)\.txt$', file)
+            filenamematch = re.match(r'^dmidecode\.(\d+)\.(?:txt|bin)$', file)
             if not filenamematch:
                 continue
             buildnum = filenamematch.group(1)
-            all_bios.append(buildnum)
+            all_bios.add(buildnum)
     return all_bios
 
-def main():
-    ''' main function '''
-    all_bioses = list_dmidecode_files(DMIDECODE_DIR)
-    # For each line, make a hash of k/v pairs based on the structure of the KB.
-    parsed_lines = list()
-    for stdin_line in sys.stdin:
-        parsed_line = match_one_line(fields, stdin_line)
-        if isinstance(parsed_line, str):
-            # strings are errors
-            print(parsed_line, file=sys.stderr)
+def evidence_for(release, bioses):
+    '''
+        The [address, date] we have a dump for, for this release, or None.
+        A dump is named for the build ESX reports, which is the installer build if there is one.
+    '''
+    for attr in ['installer_build_number', 'build_number']:
+        bios = bioses.get(release[attr])
+        if bios is not None:
+            return [bios['address'], bios['date']]
+    return None
+
+def update_key(release):
+    ''' (major, interpolated update) for a release: 6.7 and u1 '''
+    return release['major_version'], release['interpolated_update_version']
+
+def pick_capture(run):
+    '''
+        The release in a run worth capturing first.  A BIOS change is most likely to come with a
+        new update, so the first release of the middle update in the run, if the run spans more
+        than one; otherwise the middle release, which halves the run either way.
+    '''
+    update_starts = [index for index in range(1, len(run))
+                     if update_key(run[index]) != update_key(run[index - 1])]
+    if update_starts:
+        return run[update_starts[len(update_starts) // 2]]
+    return run[len(run) // 2]
+
+def coverage(releases, bioses):
+    '''
+        The coverage report for the KB releases (oldest first) against the dmidecode corpus
+        (build number -> BIOS address and date), as a dict ready for JSON:
+            versions    per major/update: how many releases, which have a dump, what BIOSes
+            gaps        every run of releases without a dump, and whether the BIOS changed
+                        across it (a transition we haven't pinned down) or not
+            next_builds the gaps' picks, most useful first: transitions before anything else,
+                        then the runs spanning the most updates, then the longest
+        Everything is one pass over the releases plus dict/set lookups, so it's linear in the
+        size of the KB.
+    '''
+    versions = {}
+    gaps = []
+    # Each gap's pick, in step with gaps.
+    captures = []
+    # Releases since the last one we have a dump for, and that dump's BIOS, in this major.
+    run = []
+    previous_bios = None
+    current_major = None
+
+    def close_run(following_bios):
+        if not run:
+            return
+        capture = pick_capture(run)
+        gaps.append({'major_version': run[0]['major_version'],
+                     'first_build': run[0]['build_number'],
+                     'last_build': run[-1]['build_number'],
+                     'releases': len(run),
+                     'updates': len({update_key(release) for release in run}),
+                     'bios_before': previous_bios,
+                     'bios_after': following_bios,
+                     'transition': (previous_bios is None or following_bios is None or
+                                    previous_bios != following_bios),
+                     'capture_build': capture['build_number']})
+        captures.append(capture)
+
+    for release in releases:
+        if release['major_version'] != current_major:
+            close_run(None)
+            run = []
+            previous_bios = None
+            current_major = release['major_version']
+        version = versions.setdefault(update_key(release), {
+            'major_version': release['major_version'],
+            'update_version': release['interpolated_update_version'],
+            'releases': 0,
+            'evidenced': 0,
+            'evidenced_builds': [],
+            'bioses': []})
+        version['releases'] += 1
+        bios = evidence_for(release, bioses)
+        if bios is None:
+            run.append(release)
             continue
-        if not isinstance(parsed_line, dict):
-            print('Invalid return type from match_one_line.', file=sys.stderr)
-            sys.exit(2)
-        if not parsed_line:
-            # comment or blank line, okay to skip.
+        version['evidenced'] += 1
+        version['evidenced_builds'].append(release['build_number'])
+        if bios not in version['bioses']:
+            version['bioses'].append(bios)
+        close_run(bios)
+        run = []
+        previous_bios = bios
+    close_run(None)
+
+    ranked = sorted((index for index, gap in enumerate(gaps) if gap['transition']),
+                    key=lambda index: (-gaps[index]['updates'], -gaps[index]['releases']))
+    next_builds = [{'build_number': captures[index]['build_number'],
+                    'installer_build_number': captures[index]['installer_build_number'],
+                    'full_version': captures[index]['full_version'],
+                    'major_version': captures[index]['major_version'],
+                    'update_version': captures[index]['interpolated_update_version'],
+                    'gap_releases': gaps[index]['releases'],
+                    'gap_updates': gaps[index]['updates']}
+                   for index in ranked]
+
+    total = sum(version['releases'] for version in versions.values())
+    evidenced = sum(version['evidenced'] for version in versions.values())
+    return {'releases': total,
+            'evidenced': evidenced,
+            'versions': list(versions.values()),
+            'gaps': gaps,
+            'next_builds': next_builds}
+
+def render_coverage_text(report, top):
+    '''
+        The coverage report as lines for a human.
+    '''
+    lines = [f'{report["evidenced"]} of {report["releases"]} releases have a dmidecode', '',
+             'Coverage by version:']
+    for version in report['versions']:
+        bioses = ' '.join(f'{address}@{date}' for address, date in version['bioses'])
+        lines.append(f'  {version["major_version"] + version["update_version"]:<10} '
+                     f'{version["evidenced"]:>5}/{version["releases"]:<5} {bioses}')
+    lines.extend(['', 'Gaps where the BIOS changed somewhere we have no dump:'])
+    for gap in report['gaps']:
+        if not gap['transition']:
             continue
-        # Note that we're insert() rather than append(), to reverse the list as we build it.
-        parsed_lines.insert(0, parsed_line)
-
-    ## Interpolate a build number and a "well, it's MOSTLY this update version" into variables for
-    ## simplicity's sake.
-
-    interpolated_update_version = ''
-    major_version_tracker = "-123456"    # just something that doesn't match a real version
-
-    # remember that this loop is handled in 'reverse list order'.
-    # because of how we sequenced inserts into parsed_lines in the last loop.
-    # i.e. we're now working from old to new / bottom to top of the KB sheet.
-    for parsed_line in parsed_lines:
-        if major_version_tracker != parsed_line['major_version']:
-            major_version_tracker = parsed_line['major_version']
-            interpolated_update_version = ''
-        else:
-            update_match = re.match(r'(?:U|Update )(\d+)', parsed_line['true_minor_version'])
-            if update_match:
-                interpolated_update_version = 'u{}'.format(update_match.group(1))
-        parsed_line['interpolated_update_version'] = interpolated_update_version
-
-        build_match = re.match(r'^\d+$', parsed_line['installer_build_number'])
-        if build_match:
-            parsed_line['interpolated_build_number'] = parsed_line['installer_build_number']
-        else:
-            parsed_line['interpolated_build_number'] = parsed_line['build_number']
+        before = ' '.join(gap['bios_before']) if gap['bios_before'] else 'nothing'
+        after = ' '.join(gap['bios_after']) if gap['bios_after'] else 'nothing'
+        lines.append(f'  {gap["major_version"]:<5} {gap["first_build"]}..{gap["last_build"]}'
+                     f' ({gap["releases"]} releases): {before} -> {after}')
+    lines.extend(['', 'Most worth capturing next:'])
+    for next_build in report['next_builds'][:top]:
+        lines.append(f'  {next_build["build_number"]:<10} {next_build["full_version"]:<20}'
+                     f' splits {next_build["gap_releases"]} releases over'
+                     f' {next_build["gap_updates"]} updates')
+    return lines
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coverage',
+                        action='store_true',
+                        default=False,
+                        help='Report coverage, gaps and what to capture next')
+    parser.add_argument('--format',
+                        choices=('text', 'json'),
+                        default=None,
+                        dest='output_format',
+                        help='Coverage report format (default text)')
+    parser.add_argument('--top',
+                        type=int,
+                        default=None,
+                        help=f'Builds to suggest capturing, in text (default {DEFAULT_TOP})')
+    parser.add_argument('--cache',
+                        dest='cachefile',
+                        metavar='FILE',
+                        help='cache dmidecode parse results in <FILE> between runs')
+    add_profile_arguments(parser)
+    cli_options = parser.parse_args(prog_args[1:])
+    # These only mean anything to the coverage report; don't let them look like they worked.
+    coverage_only = [option for option, value in (('--format', cli_options.output_format),
+                                                  ('--top', cli_options.top),
+                                                  ('--cache', cli_options.cachefile))
+                     if value is not None]
+    if coverage_only and not cli_options.coverage:
+        parser.error(f'{", ".join(coverage_only)}: only used with --coverage')
+    if cli_options.output_format is None:
+        cli_options.output_format = 'text'
+    if cli_options.top is None:
+        cli_options.top = DEFAULT_TOP
 
-        if ((parsed_line['installer_build_number'] in all_bioses) or
-                (parsed_line['build_number'] in all_bioses)):
-            print('DONE ', end='')
+    with profiled(cli_options):
+        if cli_options.coverage:
+            report_coverage(cli_options)
+            return
+        with PROFILER.stage('list_dmidecode_files'):
+            all_bioses = list_dmidecode_files(os.path.join(__location__, DMIDECODE_DIR))
+        # Report from old to new / bottom to top of the KB sheet.
+        with PROFILER.stage('parse'):
+            parsed_lines = list(parse_lines(sys.stdin, keep_full_line=True))
+        with PROFILER.stage('interpolate'):
+            output_lines = list(interpolate(parsed_lines))
+        with PROFILER.stage('report'):
+            for parsed_line in reversed(output_lines):
+                if ((parsed_line['installer_build_number'] in all_bioses) or
+                        (parsed_line['build_number'] in all_bioses)):
+                    print('DONE ', end='')
+                else:
+                    print('     ', end='')
+                print(parsed_line['full_line'])
+
+def report_coverage(cli_options):
+    '''
+        --coverage: read the KB from stdin and print the coverage report.
+    '''
+    cache = BuildCache(cli_options.cachefile) if cli_options.cachefile else None
+    with PROFILER.stage('ingest_dmidecode_files'):
+        bioses = ingest_dmidecode_files(os.path.join(__location__, DMIDECODE_DIR), cache=cache)
+    if cache is not None:
+        cache.save()
+    with PROFILER.stage('parse'):
+        parsed_lines = list(parse_lines(sys.stdin))
+    with PROFILER.stage('interpolate'):
+        # Oldest first, the same as the sheet report.
+        releases = list(reversed(list(interpolate(parsed_lines))))
+    with PROFILER.stage('coverage'):
+        report = coverage(releases, bioses)
+    with PROFILER.stage('report'):
+        if cli_options.output_format == 'json':
+            print(json.dumps(report, indent=3))
         else:
-            print('     ', end='')
-        print(parsed_line['full_line'])
+            for line in render_coverage_text(report, cli_options.top):
+                print(line)
 
 if __name__ == '__main__':
     main()
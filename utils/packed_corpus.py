@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+'''
+    The dmidecode corpus packed into one indexed file, for when one file per build gets too slow.
+
+    Per build number we keep what we actually use out of a dump (BIOS address, release date,
+    vendor and version) and a sha256 of the dump itself, and, optionally, the dump compressed.
+    The reader memory-maps the file and binary-searches a fixed-size index, so looking up one
+    build touches a few pages rather than opening anything.
+
+        ./packed_corpus.py pack --raw ../dmidecode corpus.pack
+        ./packed_corpus.py show corpus.pack 10302608
+        ./packed_corpus.py unpack corpus.pack /tmp/dmidecode
+
+    Layout, all little-endian:
+        header    magic, format version, record count, flags, pool offset and length,
+                  raw section offset and length
+        records   sorted by build number, RECORD_FORMAT each
+        pool      strings (deduplicated), pointed to by the records
+        raw       compressed dumps, pointed to by the records with 64-bit offsets, so a fleet's
+                  worth of them can run past 4GB without moving the strings out of reach
+
+    gcox@mozilla
+'''
+import os
+import re
+import sys
+import argparse
+import hashlib
+import io
+import mmap
+import shutil
+import struct
+import tempfile
+import zlib
+import smbios
+from dmidecode_scanner import MalformedDump, bios_address_and_date, scan_bios_information
+
+MAGIC          = b'VMWPACK\0'
+FORMAT_VERSION = 2
+FLAG_RAW       = 0x1
+HEADER_FORMAT  = '<8sIIIQQQQ'
+# build, kind, then (offset, length) of address, date, vendor and version in the pool, and of
+# the dump in the raw section, then sha256
+RECORD_FORMAT  = '<QB' + 'IH' * 4 + 'QI' + '32s'
+HEADER_SIZE    = struct.calcsize(HEADER_FORMAT)
+RECORD_SIZE    = struct.calcsize(RECORD_FORMAT)
+
+KINDS = ('txt', 'bin')
+
+def extract_fields(kind, filecontents):
+    '''
+        address, date, vendor and version out of a dump's raw bytes.  MalformedDump if it's a
+        table with no BIOS Information in it.
+    '''
+    if kind == 'bin':
+        try:
+            bios = smbios.bios_information(smbios.table_from_blob(filecontents))
+        except ValueError as err:
+            raise MalformedDump(str(err)) from err
+        if bios is None:
+            raise MalformedDump('no BIOS Information structure')
+        return {key: bios[key] for key in ('address', 'date', 'vendor', 'version')}
+    bios_fields = scan_bios_information(io.StringIO(filecontents.decode('utf-8',
+                                                                        errors='replace')))
+    fields = bios_address_and_date(bios_fields)
+    for key, label in (('vendor', 'Vendor'), ('version', 'Version')):
+        value = bios_fields.get(label) if bios_fields else None
+        fields[key] = value if isinstance(value, str) else None
+    return fields
+
+def scan_directory(dirname):
+    '''
+        Yield (buildnum, kind, path) for every dmidecode.NUM.txt/.bin under dirname.
+    '''
+    for root, _dirs, files in os.walk(dirname):
+        for file in files:
+            filenamematch = re.match(r'^dmidecode\.(\d+)\.(txt|bin)$', file)
+            if not filenamematch:
+                continue
+            yield int(filenamematch.group(1)), filenamematch.group(2), os.path.join(root, file)
+
+def write_packed(filename, dumps, include_raw=False):
+    '''
+        Pack an iterable of (buildnum, kind, path) into filename.  Returns the record count.
+        Each dump is read only while its record is written, so memory doesn't grow with the
+        dumps.  Dumps we can't get BIOS Information out of are reported on stderr and left out.
+    '''
+    pool = bytearray()
+    pooled_strings = {}
+
+    def pool_string(value):
+        if value is None:
+            return 0, 0xFFFF
+        encoded = value.encode('utf-8')[:0xFFFE]
+        if encoded not in pooled_strings:
+            if len(pool) > 0xFFFFFFFF:
+                raise ValueError('more than 4GB of distinct BIOS strings')
+            pooled_strings[encoded] = len(pool)
+            pool.extend(encoded)
+        return pooled_strings[encoded], len(encoded)
+
+    records = []
+    # The dumps are spooled to disk as we go rather than held until the pool is done.
+    with tempfile.TemporaryFile() as rawfilehandle:
+        raw_length_total = 0
+        for buildnum, kind, filepath in sorted(dumps):
+            with open(filepath, 'rb') as dmidecode_filehandle:
+                filecontents = dmidecode_filehandle.read()
+            try:
+                fields = extract_fields(kind, filecontents)
+            except MalformedDump as err:
+                print(f'{filepath}: {err}; skipping it', file=sys.stderr)
+                continue
+            string_refs = []
+            for key in ('address', 'date', 'vendor', 'version'):
+                string_refs.extend(pool_string(fields[key]))
+            raw_offset, raw_length = 0, 0
+            if include_raw:
+                compressed = zlib.compress(filecontents, 9)
+                raw_offset, raw_length = raw_length_total, len(compressed)
+                rawfilehandle.write(compressed)
+                raw_length_total += raw_length
+            records.append(struct.pack(RECORD_FORMAT, buildnum, KINDS.index(kind), *string_refs,
+                                       raw_offset, raw_length,
+                                       hashlib.sha256(filecontents).digest()))
+
+        pool_offset = HEADER_SIZE + RECORD_SIZE * len(records)
+        raw_section_offset = pool_offset + len(pool)
+        temp_filename = f'{filename}.tmp'
+        with open(temp_filename, 'wb') as packfilehandle:
+            packfilehandle.write(struct.pack(HEADER_FORMAT, MAGIC, FORMAT_VERSION, len(records),
+                                             FLAG_RAW if include_raw else 0, pool_offset,
+                                             len(pool), raw_section_offset, raw_length_total))
+            for record in records:
+                packfilehandle.write(record)
+            packfilehandle.write(pool)
+            rawfilehandle.seek(0)
+            shutil.copyfileobj(rawfilehandle, packfilehandle)
+        os.replace(temp_filename, filename)
+    return len(records)
+
+class PackedCorpus:
+    '''
+        Memory-mapped, random-access reader for a packed corpus.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as packfilehandle:
+            self._map = mmap.mmap(packfilehandle.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER_SIZE:
+            self.close()
+            raise ValueError(f'{filename}: too short to be a packed corpus')
+        (magic, version, self.count, self.flags, self.pool_offset, pool_length,
+         self.raw_offset, raw_length) = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f'{filename}: not a version {FORMAT_VERSION} packed corpus')
+        if (self.pool_offset + pool_length > len(self._map)
+                or self.raw_offset + raw_length > len(self._map)):
+            self.close()
+            raise ValueError(f'{filename}: truncated')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        ''' Unmap the file. '''
+        self._map.close()
+
+    @property
+    def has_raw(self):
+        ''' Whether the dumps themselves were packed. '''
+        return bool(self.flags & FLAG_RAW)
+
+    def _buildnum_at(self, index):
+        return struct.unpack_from('<Q', self._map, HEADER_SIZE + index * RECORD_SIZE)[0]
+
+    def _string(self, offset, length):
+        if length == 0xFFFF:
+            return None
+        start = self.pool_offset + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def _record(self, index):
+        (buildnum, kind, *string_refs,
+         raw_offset, raw_length, digest) = struct.unpack_from(RECORD_FORMAT, self._map,
+                                                               HEADER_SIZE + index * RECORD_SIZE)
+        record = {'buildnum': str(buildnum), 'kind': KINDS[kind], 'sha256': digest.hex(),
+                  '_raw': (raw_offset, raw_length)}
+        for position, key in enumerate(('address', 'date', 'vendor', 'version')):
+            record[key] = self._string(string_refs[position * 2], string_refs[position * 2 + 1])
+        return record
+
+    def _find(self, buildnum):
+        ''' Index of buildnum's record, or None '''
+        buildnum = int(buildnum)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._buildnum_at(middle) < buildnum:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._buildnum_at(low) == buildnum:
+            return low
+        return None
+
+    def get(self, buildnum):
+        '''
+            dict of buildnum, kind, address, date, vendor, version and sha256, or None.
+        '''
+        index = self._find(buildnum)
+        if index is None:
+            return None
+        record = self._record(index)
+        del record['_raw']
+        return record
+
+    def raw(self, buildnum):
+        '''
+            The original dump as bytes, or None if we don't have it (or didn't pack dumps).
+        '''
+        index = self._find(buildnum)
+        if index is None or not self.has_raw:
+            return None
+        return self._raw_dump(self._record(index)['_raw'])
+
+    def _raw_dump(self, raw_ref):
+        raw_offset, raw_length = raw_ref
+        start = self.raw_offset + raw_offset
+        return zlib.decompress(self._map[start:start + raw_length])
+
+    def __iter__(self):
+        for index in range(self.count):
+            record = self._record(index)
+            del record['_raw']
+            yield record
+
+    def records_with_raw(self):
+        '''
+            Yield (record, original dump) for every record, including both dumps of a build
+            that has a .txt and a .bin.
+        '''
+        for index in range(self.count):
+            record = self._record(index)
+            yield record, self._raw_dump(record.pop('_raw'))
+
+def ingest_packed_corpus(filename):
+    '''
+        The same build number -> BIOS Address and Dates dict as ingest_dmidecode_files,
+        from a packed corpus.  Like it, dumps without an address and a date are reported on
+        stderr and left out.
+    '''
+    all_bios = {}
+    with PackedCorpus(filename) as corpus:
+        for record in corpus:
+            if record['address'] is None or record['date'] is None:
+                print(f'{filename}: dmidecode.{record["buildnum"]}.{record["kind"]} has no '
+                      'usable address or date; skipping it', file=sys.stderr)
+                continue
+            all_bios[record['buildnum']] = {'address': record['address'],
+                                            'date': record['date']}
+    return all_bios
+
+def unpack(filename, dirname):
+    '''
+        Write a packed corpus back out as dmidecode.NUM.txt/.bin files.  Returns the file count.
+    '''
+    os.makedirs(dirname, exist_ok=True)
+    written = 0
+    with PackedCorpus(filename) as corpus:
+        if not corpus.has_raw:
+            raise ValueError(f'{filename} was packed without the dumps; nothing to unpack')
+        for record, dump in corpus.records_with_raw():
+            dump_filename = os.path.join(dirname,
+                                         f'dmidecode.{record["buildnum"]}.{record["kind"]}')
+            with open(dump_filename, 'wb') as dump_filehandle:
+                dump_filehandle.write(dump)
+            written += 1
+    return written
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    pack_parser = subparsers.add_parser('pack', help='Pack a dmidecode directory')
+    pack_parser.add_argument('--raw',
+                             action='store_true',
+                             default=False,
+                             help='Include the (compressed) dumps themselves')
+    pack_parser.add_argument('dirname', metavar='DIR')
+    pack_parser.add_argument('filename', metavar='FILE')
+    unpack_parser = subparsers.add_parser('unpack', help='Unpack into a dmidecode directory')
+    unpack_parser.add_argument('filename', metavar='FILE')
+    unpack_parser.add_argument('dirname', metavar='DIR')
+    show_parser = subparsers.add_parser('show', help='Show records in a packed corpus')
+    show_parser.add_argument('filename', metavar='FILE')
+    show_parser.add_argument('buildnums', metavar='BUILD', nargs='*')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    try:
+        if cli_options.command == 'pack':
+            count = write_packed(cli_options.filename, scan_directory(cli_options.dirname),
+                                 include_raw=cli_options.raw)
+            print(f'Packed {count} builds into {cli_options.filename}', file=sys.stderr)
+        elif cli_options.command == 'unpack':
+            count = unpack(cli_options.filename, cli_options.dirname)
+            print(f'Unpacked {count} builds into {cli_options.dirname}', file=sys.stderr)
+        else:
+            with PackedCorpus(cli_options.filename) as corpus:
+                if cli_options.buildnums:
+                    records = [corpus.get(buildnum) or {'buildnum': buildnum}
+                               for buildnum in cli_options.buildnums]
+                else:
+                    records = corpus
+                for record in records:
+                    print(' '.join(str(record.get(key)) for key in
+                                   ('buildnum', 'address', 'date', 'vendor', 'version')))
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+    Per-stage timing and counters for the scripts in here, reported as JSON with --profile.
+
+    There's one PROFILER for the process.  It starts out disabled, and while disabled stage()
+    hands back a do-nothing context and count() returns straight away, so the instrumentation
+    can stay in the code for good.
+
+        with PROFILER.stage('ingest_json'):
+            ...
+        PROFILER.count('files_opened')
+
+    gcox@mozilla
+'''
+import sys
+import contextlib
+import cProfile
+import json
+import time
+try:
+    import resource
+except ImportError:
+    # Not on Windows; the report just goes without peak memory there.
+    resource = None
+
+_NOT_PROFILING = contextlib.nullcontext()
+
+class Profiler:
+    '''
+        Wall and CPU time per named stage, plus named counters.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+
+    def stage(self, name):
+        ''' Time the with-block as stage <name>.  Repeated stages add up. '''
+        if not self.enabled:
+            return _NOT_PROFILING
+        return self._timed_stage(name)
+
+    @contextlib.contextmanager
+    def _timed_stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            stats = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+            stats['wall'] += time.perf_counter() - wall_start
+            stats['cpu'] += time.process_time() - cpu_start
+            stats['calls'] += 1
+
+    def count(self, name, amount=1):
+        ''' Add amount to counter <name>. '''
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self):
+        ''' Everything we've recorded, as a dict ready for JSON. '''
+        peak_rss_kb = None
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux.
+            peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'stages': self.stages,
+                'counters': self.counters,
+                'peak_rss_kb': peak_rss_kb}
+
+PROFILER = Profiler()
+
+def add_profile_arguments(parser):
+    '''
+        The --profile and --cprofile options every script takes.
+    '''
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const='-',
+                        dest='profile',
+                        metavar='FILE',
+                        help='write a JSON timing/counter report to <FILE> (default: stderr)')
+    parser.add_argument('--cprofile',
+                        dest='cprofile',
+                        metavar='FILE',
+                        help='also dump cProfile stats to <FILE>')
+
+@contextlib.contextmanager
+def profiled(cli_options):
+    '''
+        Run the with-block with profiling turned on if the options asked for it, and write the
+        report(s) out at the end, even if the block exits.
+    '''
+    if not cli_options.profile and not cli_options.cprofile:
+        yield
+        return
+    PROFILER.enabled = True
+    cprofiler = cProfile.Profile() if cli_options.cprofile else None
+    if cprofiler is not None:
+        cprofiler.enable()
+    try:
+        with PROFILER.stage('total'):
+            yield
+    finally:
+        if cprofiler is not None:
+            cprofiler.disable()
+            cprofiler.dump_stats(cli_options.cprofile)
+        if cli_options.profile:
+            json_text = json.dumps(PROFILER.report(), indent=3)
+            if cli_options.profile == '-':
+                print(json_text, file=sys.stderr)
+            else:
+                with open(cli_options.profile, 'w') as reportfilehandle:
+                    print(json_text, file=reportfilehandle)
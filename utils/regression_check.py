@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+'''
+    Make sure a faster engine is still the same engine.
+
+    Equivalence: the scripts as of a git revision (--reference; by default the tag
+    regression-baseline, which marks the scripts as they were before the faster engines went
+    in) are the reference.  They and the scripts in this
+    working tree are each run, as scripts, over the real corpus and over --corpora randomized
+    synthetic ones, and every output has to match byte for byte: the JSON, missing_dmidecodes.py,
+    and matchup_bios_to_string.py plain, --minor, --minor-error-high, --dump and --template (with
+    the reference's own templates, which both have to understand).
+
+    Throughput: benchmark.py's stages, over a synthetic corpus of the size recorded in
+    --baseline, have to manage at least (1 - --tolerance) of the recorded throughput.  Machines
+    differ, so throughput is never kept in builds per second: it's builds per run of a fixed
+    calibration loop, timed on the same machine in the same run, and that is what --baseline
+    holds and what --record-baseline writes.
+
+        ./regression_check.py
+        ./regression_check.py --reference HEAD~1 --corpora 10
+        ./regression_check.py --record-baseline
+
+    Exits non-zero if anything differs or throughput has regressed.
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import io
+import json
+import platform
+import random
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+import benchmark
+import synthetic_corpus
+
+__location__ = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(__location__)
+# A tag on the last commit before the faster engines went in.  Clones that don't have it can
+# make it with `git tag regression-baseline REV`, or pass --reference.
+BASELINE_REFERENCE = 'regression-baseline'
+KB_FILE = os.path.join(__location__, 'raw_data_from_KB.txt')
+DEFAULT_BASELINE = os.path.join(__location__, 'throughput_baseline.json')
+DEFAULT_CORPORA = 3
+DEFAULT_MAX_BUILDS = 3000
+DEFAULT_THROUGHPUT_SIZE = 20000
+DEFAULT_TOLERANCE = 0.25
+
+MATCHUP_FLAGS = ([], ['--minor'], ['--minor', '--minor-error-high'], ['--minor-error-high'],
+                 ['--dump'], ['--dump', '--minor'])
+
+# The calibration loop's input: KB-shaped rows, made here rather than by synthetic_corpus.py so
+# the loop never changes along with the code it's measuring.
+CALIBRATION_ROWS = [f'ESXi 6.{row % 8} EP {row % 30:02d}\tESXi6{row % 8}-{100000 + row * 37}\t'
+                    f'{row % 12 + 1}/{row % 28 + 1}/{2009 + row % 10}\t{100000 + row * 37}\tN/A'
+                    for row in range(20000)]
+CALIBRATION_MATCHER = re.compile(r'^ESXi (\S+) (.+?)\t(\S+)\t(\d+)/(\d+)/(\d+)\t(\d+)\t(\S+)$')
+
+def export_reference(revision, dest):
+    '''
+        The utils directory as of revision, under dest/utils.
+    '''
+    archive = subprocess.run(['git', 'archive', '--format=tar', revision, 'utils'],
+                             cwd=REPO_ROOT, check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tarball:
+        if hasattr(tarfile, 'data_filter'):
+            tarball.extractall(dest, filter='data')
+        else:
+            # Pythons without extraction filters (before 3.8.17/3.11.4); the archive is our own.
+            tarball.extractall(dest)
+
+def export_candidate(dest):
+    '''
+        This working tree's utils directory, under dest/utils.
+    '''
+    shutil.copytree(__location__, os.path.join(dest, 'utils'),
+                    ignore=shutil.ignore_patterns('__pycache__', '*.pyc', '.build_cache.json'))
+
+def install_corpus(side_dir, dmidecode_dir):
+    '''
+        Give a side its own (empty) build_numbers and a copy of the corpus's dumps, where its
+        scripts expect them: next to its utils.
+    '''
+    for name in ('build_numbers', 'dmidecode'):
+        shutil.rmtree(os.path.join(side_dir, name), ignore_errors=True)
+    os.makedirs(os.path.join(side_dir, 'build_numbers'))
+    shutil.copytree(dmidecode_dir, os.path.join(side_dir, 'dmidecode'))
+
+def run_script(side_dir, script, args, stdin_file=None):
+    '''
+        Run one of a side's scripts from its utils directory.  Returns (exit code, stdout).
+    '''
+    utils_dir = os.path.join(side_dir, 'utils')
+    with open(stdin_file if stdin_file else os.devnull, 'rb') as stdin_filehandle:
+        completed = subprocess.run([sys.executable, script] + args, cwd=utils_dir,
+                                   stdin=stdin_filehandle, capture_output=True)
+    return completed.returncode, completed.stdout
+
+def side_outputs(side_dir, kb_file, template_files):
+    '''
+        Every output we compare, for one side over the corpus installed in it, as a dict of
+        description -> (exit code, stdout).
+    '''
+    outputs = {}
+    outputs['create_esxi_build_numbers_json.py'] = run_script(
+        side_dir, 'create_esxi_build_numbers_json.py', [], stdin_file=kb_file)
+    with open(os.path.join(side_dir, 'build_numbers', 'esxi_build_numbers.json'),
+              'wb') as jsonfilehandle:
+        jsonfilehandle.write(outputs['create_esxi_build_numbers_json.py'][1])
+    outputs['missing_dmidecodes.py'] = run_script(side_dir, 'missing_dmidecodes.py', [],
+                                                  stdin_file=kb_file)
+    flag_sets = list(MATCHUP_FLAGS)
+    for template_file in template_files:
+        flag_sets.append(['--template', template_file])
+        flag_sets.append(['--minor', '--template', template_file])
+    for flags in flag_sets:
+        outputs[' '.join(['matchup_bios_to_string.py'] + flags)] = run_script(
+            side_dir, 'matchup_bios_to_string.py', flags)
+    return outputs
+
+def first_difference(reference, candidate):
+    ''' The first line that differs between two outputs, for the report. '''
+    reference_lines = reference.decode('utf-8', errors='replace').splitlines()
+    candidate_lines = candidate.decode('utf-8', errors='replace').splitlines()
+    for number, (reference_line, candidate_line) in enumerate(zip(reference_lines,
+                                                                  candidate_lines), 1):
+        if reference_line != candidate_line:
+            return f'line {number}: {reference_line!r} != {candidate_line!r}'
+    return f'{len(reference_lines)} lines != {len(candidate_lines)} lines'
+
+def compare_corpus(name, kb_file, dmidecode_dir, reference_dir, candidate_dir, template_files):
+    '''
+        Run both sides over one corpus.  Returns a list of mismatch descriptions.
+    '''
+    results = {}
+    for side_dir in (reference_dir, candidate_dir):
+        install_corpus(side_dir, dmidecode_dir)
+        results[side_dir] = side_outputs(side_dir, kb_file, template_files)
+    mismatches = []
+    for description, (reference_code, reference_output) in results[reference_dir].items():
+        candidate_code, candidate_output = results[candidate_dir][description]
+        if reference_code != candidate_code:
+            mismatches.append(f'{name}: {description}: exit {reference_code} != '
+                              f'{candidate_code}')
+        elif reference_output != candidate_output:
+            mismatches.append(f'{name}: {description}: '
+                              f'{first_difference(reference_output, candidate_output)}')
+    print(f'{name}: {len(results[reference_dir])} outputs compared, '
+          f'{len(mismatches)} differ', file=sys.stderr)
+    return mismatches
+
+def check_equivalence(options, workdir):
+    '''
+        Compare reference and candidate over the real corpus and the synthetic ones.
+        Returns a list of mismatch descriptions; empty is good.
+    '''
+    reference_dir = os.path.join(workdir, 'reference')
+    candidate_dir = os.path.join(workdir, 'candidate')
+    export_reference(options.reference, reference_dir)
+    export_candidate(candidate_dir)
+    template_dir = os.path.join(reference_dir, 'utils', 'templates')
+    template_files = sorted(os.path.join(template_dir, template)
+                            for template in os.listdir(template_dir))
+
+    mismatches = compare_corpus('real corpus', KB_FILE, os.path.join(REPO_ROOT, 'dmidecode'),
+                                reference_dir, candidate_dir, template_files)
+    rng = random.Random(options.seed)
+    for corpus in range(options.corpora):
+        num_builds = rng.randint(len(synthetic_corpus.MAJORS), options.max_builds)
+        dump_fraction = rng.uniform(0.05, 0.9)
+        corpus_seed = rng.randrange(2 ** 32)
+        # Sometimes several updates to a BIOS date, so the rounding choices get tried too.
+        updates_per_bios_date = rng.choice((1, 2, 3))
+        corpus_dir = os.path.join(workdir, f'synthetic.{corpus}')
+        os.makedirs(corpus_dir)
+        kb_file, dmidecode_dir, _count = synthetic_corpus.write_corpus(
+            corpus_dir, num_builds, dump_fraction=dump_fraction, seed=corpus_seed,
+            updates_per_bios_date=updates_per_bios_date)
+        mismatches.extend(compare_corpus(
+            f'synthetic corpus {corpus} ({num_builds} builds, {dump_fraction:.2f} dumped, '
+            f'{updates_per_bios_date} updates per BIOS date, seed {corpus_seed})',
+            kb_file, dmidecode_dir, reference_dir, candidate_dir, template_files))
+    return mismatches
+
+def calibration_loop():
+    '''
+        A fixed bit of work much like ours (match KB rows, file them by build, sort them), to
+        time this machine with.
+    '''
+    releases = {}
+    for row in CALIBRATION_ROWS:
+        rowmatch = CALIBRATION_MATCHER.match(row)
+        releases[rowmatch.group(7)] = {'version': rowmatch.group(1),
+                                       'date': (rowmatch.group(6), rowmatch.group(4),
+                                                rowmatch.group(5))}
+    return sorted(releases.items(), key=lambda release: (release[1]['date'], int(release[0])))
+
+def calibration_seconds(repeat):
+    ''' The fastest of repeat runs of the calibration loop. '''
+    timings = []
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        calibration_loop()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def measure_throughput(workdir, size, seed, dump_fraction, repeat):
+    '''
+        benchmark.py's stages over a synthetic corpus of size builds, each stage's time in
+        calibration loops, and throughput in builds per calibration loop.
+    '''
+    options = argparse.Namespace(dump_fraction=dump_fraction, seed=seed, repeat=repeat,
+                                 minor_version=False, minor_high=False)
+    # Calibrate on both sides of the benchmark and keep the faster, so a busy moment at either
+    # end doesn't skew the ratio.
+    calibration = calibration_seconds(repeat)
+    result = benchmark.benchmark_size(workdir, size, options)
+    calibration = min(calibration, calibration_seconds(repeat))
+    return {'size': size,
+            'seed': seed,
+            'dump_fraction': dump_fraction,
+            'stages': {stage: seconds / calibration
+                       for stage, seconds in result['stages'].items()},
+            'builds_per_calibration': size * calibration / result['total'],
+            'builds_per_second': size / result['total']}
+
+def check_throughput(options, workdir):
+    '''
+        Measure throughput and compare it with (or record it as) the baseline.
+        Returns a list of regression descriptions; empty is good.
+    '''
+    baseline = None
+    if not options.record_baseline:
+        try:
+            with open(options.baseline, 'r') as baselinefilehandle:
+                baseline = json.load(baselinefilehandle)
+        except OSError as err:
+            return [f'no throughput baseline to check against ({err}); '
+                    'run with --record-baseline first']
+    size = baseline['size'] if baseline else options.throughput_size
+    seed = baseline['seed'] if baseline else options.seed
+    dump_fraction = baseline['dump_fraction'] if baseline else 0.25
+    measured = measure_throughput(workdir, size, seed, dump_fraction, options.repeat)
+    # builds/s is only for the person watching; it means nothing on another machine.
+    builds_per_second = measured.pop('builds_per_second')
+    print(f'throughput: {measured["builds_per_calibration"]:.0f} builds per calibration loop '
+          f'({builds_per_second:.0f} builds/s here) at {size} builds', file=sys.stderr)
+
+    if options.record_baseline:
+        measured.update({'revision': benchmark.git_revision(),
+                         'python': platform.python_version()})
+        with open(options.baseline, 'w') as baselinefilehandle:
+            print(json.dumps(measured, indent=3), file=baselinefilehandle)
+        print(f'recorded baseline in {options.baseline}', file=sys.stderr)
+        return []
+
+    if 'builds_per_calibration' not in baseline:
+        return [f'{options.baseline} predates calibration; run with --record-baseline']
+    floor = baseline['builds_per_calibration'] * (1 - options.tolerance)
+    if measured['builds_per_calibration'] >= floor:
+        return []
+    stages = ', '.join(f'{stage} {loops:.2f} (was {baseline["stages"].get(stage, 0):.2f})'
+                       for stage, loops in measured['stages'].items())
+    return [f'throughput {measured["builds_per_calibration"]:.0f} builds per calibration loop '
+            f'is under {floor:.0f} (baseline {baseline["builds_per_calibration"]:.0f}, '
+            f'tolerance {options.tolerance:g}); stages, in calibration loops: {stages}']
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reference',
+                        default=BASELINE_REFERENCE,
+                        metavar='REV',
+                        help='git revision whose scripts are the reference (default: the tag '
+                             f'{BASELINE_REFERENCE}, before the faster engines)')
+    parser.add_argument('--corpora',
+                        type=int,
+                        default=DEFAULT_CORPORA,
+                        help='How many randomized synthetic corpora to compare over')
+    parser.add_argument('--max-builds',
+                        type=int,
+                        default=DEFAULT_MAX_BUILDS,
+                        dest='max_builds',
+                        help='Largest synthetic corpus, in KB builds')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed for the synthetic corpora')
+    parser.add_argument('--baseline',
+                        default=DEFAULT_BASELINE,
+                        metavar='FILE',
+                        help='Recorded throughput baseline (default throughput_baseline.json)')
+    parser.add_argument('--record-baseline',
+                        action='store_true',
+                        default=False,
+                        dest='record_baseline',
+                        help='Measure throughput and record it as the baseline')
+    parser.add_argument('--throughput-size',
+                        type=int,
+                        default=DEFAULT_THROUGHPUT_SIZE,
+                        dest='throughput_size',
+                        help='Corpus size to record a baseline at, in KB builds')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=DEFAULT_TOLERANCE,
+                        help='Fraction of baseline throughput we can lose before failing')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help='Time each stage this many times and keep the fastest')
+    parser.add_argument('--skip-equivalence',
+                        action='store_true',
+                        default=False,
+                        dest='skip_equivalence',
+                        help='Only check throughput')
+    parser.add_argument('--skip-throughput',
+                        action='store_true',
+                        default=False,
+                        dest='skip_throughput',
+                        help='Only check equivalence')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='vmware_regression.') as workdir:
+        if not cli_options.skip_equivalence:
+            try:
+                failures.extend(check_equivalence(cli_options, os.path.join(workdir, 'equiv')))
+            except subprocess.CalledProcessError as err:
+                print(f'cannot export {cli_options.reference}: {err.stderr.decode().strip()}',
+                      file=sys.stderr)
+                if cli_options.reference == BASELINE_REFERENCE:
+                    print(f'tag the commit to compare against with `git tag {BASELINE_REFERENCE} '
+                          'REV`, or pass --reference', file=sys.stderr)
+                sys.exit(2)
+        if not cli_options.skip_throughput:
+            failures.extend(check_throughput(cli_options, os.path.join(workdir, 'bench')))
+    for failure in failures:
+        print(f'FAIL {failure}', file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print('OK', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+'''
+    Render every variant of the mapping (major, minor, rounded low or high) and every template,
+    from one ingest.  The same as running matchup_bios_to_string.py once per flag combination
+    and template, without re-reading and re-sorting everything each time.
+
+        ./render_variants.py --output-dir ../variants
+
+    writes, for each variant, ../variants/VARIANT/mapping.txt (the plain mapping) and
+    ../variants/VARIANT/TEMPLATE for each template.
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import glob
+from build_cache import BuildCache
+from bios_resolver import BUILD_NUM_JSON_FILE, DMIDECODE_DIR, VARIANTS, Resolver
+from matchup_bios_to_string import render_template, render_text
+
+__location__ = os.path.dirname(os.path.abspath(__file__))
+# Default templates are named for the header the way the Makefile names them to
+# matchup_bios_to_string.py --template: relative to this directory.
+TEMPLATE_SUBDIR = 'templates'
+TEMPLATE_DIR = os.path.join(__location__, TEMPLATE_SUBDIR)
+
+def write_lines(filename, lines):
+    ''' Write out rendered lines, the way print() would have. '''
+    with open(filename, 'w') as outputfilehandle:
+        for line in lines:
+            print(line, file=outputfilehandle)
+
+def render_variants(resolver, variants, templates, output_dir, fact_cache=None):
+    '''
+        Write each variant's mapping and templates under output_dir/VARIANT/.  templates is a
+        list of (template file, name for the generated header).
+        Returns the list of files written.
+    '''
+    written = []
+    for variant in variants:
+        minor, round_high = VARIANTS[variant]
+        line_order = resolver.line_order(minor=minor, round_high=round_high)
+        variant_dir = os.path.join(output_dir, variant)
+        os.makedirs(variant_dir, exist_ok=True)
+        outputs = [('mapping.txt', render_text(line_order))]
+        for templatefile, template_name in templates:
+            outputs.append((os.path.basename(templatefile),
+                            render_template(line_order, templatefile, fact_cache,
+                                            template_name=template_name)))
+        for filename, lines in outputs:
+            filepath = os.path.join(variant_dir, filename)
+            write_lines(filepath, lines)
+            written.append(filepath)
+    return written
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variants',
+                        nargs='+',
+                        choices=sorted(VARIANTS),
+                        default=list(VARIANTS),
+                        help='Which variants to render (default: all of them)')
+    parser.add_argument('--templates',
+                        nargs='+',
+                        metavar='FILE',
+                        help='Templates to render (default: everything in templates/)')
+    parser.add_argument('--output-dir',
+                        dest='output_dir',
+                        metavar='DIR',
+                        required=True,
+                        help='Write each variant to <DIR>/VARIANT/')
+    parser.add_argument('--fact-cache',
+                        dest='fact_cache',
+                        metavar='FILE',
+                        help='generated facts cache their answer in <FILE> for the current boot')
+    parser.add_argument('--cache',
+                        dest='cachefile',
+                        metavar='FILE',
+                        help='cache parse results in <FILE> between runs')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    if cli_options.templates is None:
+        templates = [(templatefile, os.path.join(TEMPLATE_SUBDIR, os.path.basename(templatefile)))
+                     for templatefile in sorted(glob.glob(os.path.join(TEMPLATE_DIR, '*')))]
+    else:
+        templates = [(templatefile, templatefile) for templatefile in cli_options.templates]
+    if not templates:
+        print(f'No templates to render in {TEMPLATE_DIR}', file=sys.stderr)
+        sys.exit(2)
+
+    cache = BuildCache(cli_options.cachefile) if cli_options.cachefile else None
+    resolver = Resolver.from_files(BUILD_NUM_JSON_FILE, DMIDECODE_DIR, cache=cache)
+    if cache is not None:
+        cache.save()
+        cache.report()
+    render_variants(resolver, cli_options.variants, templates, cli_options.output_dir,
+                    fact_cache=cli_options.fact_cache)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+'''
+    Read the BIOS Information (DMI type 0) straight out of an SMBIOS table, no dmidecode needed.
+
+    Input is either the raw table, as in /sys/firmware/dmi/tables/DMI, or a saved copy with the
+    entry point in front of it, as written by `dmidecode --dump-bin FILE`.  Either can go in the
+    dmidecode directory as dmidecode.NUM.bin alongside the text dumps.
+
+    The address and date come out formatted exactly as dmidecode prints them, so they match up
+    with everything we've collected from text dumps.
+
+        ./smbios.py                                 # this machine
+        ./smbios.py ../dmidecode/dmidecode.NUM.bin
+
+    gcox@mozilla
+'''
+import sys
+import struct
+
+SYSFS_DMI_TABLE = '/sys/firmware/dmi/tables/DMI'
+
+BIOS_INFORMATION = 0
+END_OF_TABLE     = 127
+
+def parse_entry_point(data):
+    '''
+        Decode a 32-bit (_SM_) or 64-bit (_SM3_) entry point.
+        Returns dict of version, table_address and table_length, or None if this isn't one.
+    '''
+    if data[:5] == b'_SM3_' and len(data) >= 0x18:
+        major, minor = struct.unpack_from('<BB', data, 0x07)
+        table_length, table_address = struct.unpack_from('<IQ', data, 0x0C)
+    elif data[:4] == b'_SM_' and len(data) >= 0x1F:
+        major, minor = struct.unpack_from('<BB', data, 0x06)
+        table_length, table_address = struct.unpack_from('<HI', data, 0x16)
+    else:
+        return None
+    return {'version': f'{major}.{minor}',
+            'table_address': table_address,
+            'table_length': table_length}
+
+def table_from_blob(data):
+    '''
+        Find the structure table in a blob: after the entry point if there is one (a dump-bin
+        file records where it put the table), otherwise the blob is the table.
+    '''
+    entry_point = parse_entry_point(data)
+    if entry_point is None:
+        return data
+    start = entry_point['table_address']
+    return data[start:start + entry_point['table_length']]
+
+def iter_structures(table):
+    '''
+        Yield (type, handle, formatted area, strings) for each structure in the table.
+        Strings are decoded and in table order, so string number N is strings[N - 1].
+    '''
+    offset = 0
+    while offset + 4 <= len(table):
+        struct_type, length, handle = struct.unpack_from('<BBH', table, offset)
+        if length < 4:
+            raise ValueError(f'SMBIOS structure at offset {offset} claims length {length}')
+        strings_start = offset + length
+        strings_end = table.find(b'\0\0', strings_start)
+        if strings_end < 0:
+            raise ValueError(f'SMBIOS structure at offset {offset} has no string terminator')
+        strings = [raw.decode('ascii', errors='replace')
+                   for raw in table[strings_start:strings_end].split(b'\0') if raw]
+        yield struct_type, handle, table[offset:strings_start], strings
+        if struct_type == END_OF_TABLE:
+            return
+        offset = strings_end + 2
+
+def smbios_string(strings, number):
+    ''' String number N of a structure, as dmidecode would show it. '''
+    if number == 0:
+        return None
+    if number > len(strings):
+        return '<BAD INDEX>'
+    return strings[number - 1]
+
+def bios_information(table):
+    '''
+        Decode the first BIOS Information structure in the table.
+        Returns dict of vendor, version, date and address (None where the BIOS doesn't say),
+        or None if there isn't one.
+    '''
+    for struct_type, _handle, formatted, strings in iter_structures(table):
+        if struct_type != BIOS_INFORMATION:
+            continue
+        if len(formatted) < 0x12:
+            raise ValueError(f'BIOS Information structure is only {len(formatted)} bytes')
+        vendor, version, segment, date = struct.unpack_from('<BBHB', formatted, 0x04)
+        return {'vendor': smbios_string(strings, vendor),
+                'version': smbios_string(strings, version),
+                'date': smbios_string(strings, date),
+                # dmidecode leaves the address out for a zero segment (e.g. UEFI).
+                'address': f'0x{segment:04X}0' if segment else None}
+    return None
+
+def read_bios_information(filename=SYSFS_DMI_TABLE):
+    '''
+        bios_information() for a table or dump-bin file on disk.
+    '''
+    with open(filename, 'rb') as smbios_filehandle:
+        data = smbios_filehandle.read()
+    return bios_information(table_from_blob(data))
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    filename = prog_args[1] if len(prog_args) > 1 else SYSFS_DMI_TABLE
+    try:
+        bios = read_bios_information(filename)
+    except (OSError, ValueError) as err:
+        print(f'{filename}: {err}', file=sys.stderr)
+        sys.exit(1)
+    if bios is None:
+        print(f'{filename}: no BIOS Information structure', file=sys.stderr)
+        sys.exit(1)
+    print('BIOS Information')
+    for label, key in (('Vendor', 'vendor'), ('Version', 'version'),
+                       ('Release Date', 'date'), ('Address', 'address')):
+        if bios[key] is not None:
+            print(f'\t{label}: {bios[key]}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+'''
+    Check the SMBIOS decoders against the text dumps: for every dmidecode.NUM.bin in --bin-dir
+    that has a dmidecode.NUM.txt in the corpus, smbios.py and the ruby decoder in the fact
+    template both have to read the same address and date out of the table as we read out of
+    the text.
+
+    The tables in fixtures/smbios are not captures: synthetic_corpus.py made them from the text
+    dumps of the same builds (three bare tables and one dump-bin file), so they only show that
+    our decoders read what our encoder wrote.  Check real ones (/sys/firmware/dmi/tables/DMI, or
+    `dmidecode --dump-bin`) with --bin-dir wherever they are.
+
+    The ruby decoder only ever sees /sys/firmware/dmi/tables/DMI, which is just the table, so
+    it's handed the table out of a dump-bin file rather than the whole file.
+
+        ./smbios_equivalence.py
+        ./smbios_equivalence.py --bin-dir ../dmidecode
+
+    Exits non-zero if any of them disagree.  Needs ruby.
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import re
+import subprocess
+import tempfile
+import smbios
+from bios_resolver import DMIDECODE_DIR
+from dmidecode_scanner import required_bios, scan_bios_information
+
+__location__ = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_FILE = os.path.join(__location__, 'templates', 'vmware_version.rb')
+FIXTURE_DIR = os.path.join(__location__, 'fixtures', 'smbios')
+DECODER_MATCHER = re.compile(r'^smbios_bios_information = lambda do.*?^end$', re.M | re.S)
+
+# Prints "address<TAB>date" for each table file named on the command line.
+DECODER_DRIVER = '''
+ARGV.each do |tablefile|
+    biosaddress, biosdate = smbios_bios_information.call(tablefile)
+    puts "#{biosaddress}\\t#{biosdate}"
+end
+'''
+
+def ruby_decoder(templatefile):
+    ''' The smbios_bios_information lambda, as ruby source, out of the fact template. '''
+    with open(templatefile, 'r') as templatefilehandle:
+        decoder = DECODER_MATCHER.search(templatefilehandle.read())
+    if decoder is None:
+        raise ValueError(f'{templatefile}: no smbios_bios_information lambda')
+    return decoder.group(0)
+
+def ruby_answers(templatefile, table_files, workdir):
+    '''
+        (address, date) from the ruby decoder for each table file, in order.
+    '''
+    script = os.path.join(workdir, 'decoder.rb')
+    with open(script, 'w') as scriptfilehandle:
+        scriptfilehandle.write(ruby_decoder(templatefile) + '\n' + DECODER_DRIVER)
+    completed = subprocess.run(['ruby', script] + table_files, capture_output=True, text=True,
+                               check=False)
+    if completed.returncode != 0:
+        raise RuntimeError(f'ruby exited {completed.returncode}: {completed.stderr.strip()}')
+    return [tuple(line.split('\t')) for line in completed.stdout.splitlines()]
+
+def fixture_pairs(bin_dir, dmidecode_dir):
+    ''' (binary, text) paths for every build number that has both. '''
+    pairs = []
+    for file in sorted(os.listdir(bin_dir)):
+        filenamematch = re.match(r'^(dmidecode\.\d+)\.bin$', file)
+        if not filenamematch:
+            continue
+        text_file = os.path.join(dmidecode_dir, f'{filenamematch.group(1)}.txt')
+        if os.path.exists(text_file):
+            pairs.append((os.path.join(bin_dir, file), text_file))
+    return pairs
+
+def compare_fixtures(pairs, templatefile, workdir):
+    '''
+        Returns a list of mismatch descriptions; empty is good.
+    '''
+    expected = []
+    from_python = []
+    table_files = []
+    for index, (binary_file, text_file) in enumerate(pairs):
+        with open(text_file, 'r') as text_filehandle:
+            bios = required_bios(scan_bios_information(text_filehandle))
+        expected.append((bios['address'], bios['date']))
+        with open(binary_file, 'rb') as binary_filehandle:
+            table = smbios.table_from_blob(binary_filehandle.read())
+        decoded = smbios.bios_information(table) or {}
+        from_python.append((decoded.get('address'), decoded.get('date')))
+        table_file = os.path.join(workdir, f'table.{index}')
+        with open(table_file, 'wb') as table_filehandle:
+            table_filehandle.write(table)
+        table_files.append(table_file)
+    from_ruby = ruby_answers(templatefile, table_files, workdir)
+
+    mismatches = []
+    for (binary_file, _text_file), text, python, ruby in zip(pairs, expected, from_python,
+                                                             from_ruby):
+        for decoder, decoded in (('smbios.py', python), ('ruby', ruby)):
+            if decoded != text:
+                mismatches.append(f'{os.path.basename(binary_file)}: {decoder} read '
+                                  f'{" ".join(map(str, decoded))}, the text dump says '
+                                  f'{" ".join(text)}')
+    return mismatches
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dmidecode-dir',
+                        default=os.path.join(__location__, DMIDECODE_DIR),
+                        dest='dmidecode_dir',
+                        metavar='DIR',
+                        help='Corpus to find the dmidecode.NUM.txt dumps in')
+    parser.add_argument('--bin-dir',
+                        default=FIXTURE_DIR,
+                        dest='bin_dir',
+                        metavar='DIR',
+                        help='Where the dmidecode.NUM.bin tables are (default fixtures/smbios)')
+    parser.add_argument('--template',
+                        default=TEMPLATE_FILE,
+                        dest='templatefile',
+                        metavar='FILE',
+                        help='Fact template whose ruby decoder to check')
+    cli_options = parser.parse_args(prog_args[1:])
+
+    pairs = fixture_pairs(cli_options.bin_dir, cli_options.dmidecode_dir)
+    if not pairs:
+        print(f'{cli_options.bin_dir}: no dmidecode.NUM.bin with a .txt in '
+              f'{cli_options.dmidecode_dir} to check against', file=sys.stderr)
+        sys.exit(2)
+    try:
+        with tempfile.TemporaryDirectory(prefix='vmware_smbios.') as workdir:
+            mismatches = compare_fixtures(pairs, cli_options.templatefile, workdir)
+    except (OSError, ValueError, RuntimeError) as err:
+        print(err, file=sys.stderr)
+        sys.exit(2)
+
+    for mismatch in mismatches:
+        print(f'FAIL {mismatch}')
+    if mismatches:
+        sys.exit(1)
+    print(f'OK: {len(pairs)} tables')
+
+if __name__ == '__main__':
+    main()
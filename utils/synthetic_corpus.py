@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+'''
+    Make up a KB scrape and a dmidecode directory of any size, for benchmarking the pipeline.
+
+    The rows are in the raw_data_from_KB.txt tab format (newest first), and the dumps look like
+    `dmidecode -t bios` from a guest.  Each major version has its own run of build numbers, an
+    'Update N' every so often, and BIOS addresses that are shared by pairs of updates (with
+    different dates), so the ambiguous-address paths get exercised as well as the simple ones.
+    None of this is real data; never mix it into ../dmidecode.
+
+        ./synthetic_corpus.py --builds 100000 /tmp/corpus
+
+    gcox@mozilla
+'''
+import os
+import sys
+import argparse
+import datetime
+import random
+import struct
+
+MAJORS = ('4.0', '4.1', '5.0', '5.1', '5.5', '6.0', '6.5', '6.7')
+RELEASES_PER_UPDATE = 12
+
+DMIDECODE_TEMPLATE = '''# dmidecode 3.1
+Getting SMBIOS data from sysfs.
+SMBIOS 2.7 present.
+
+Handle 0x0000, DMI type 0, 24 bytes
+BIOS Information
+	Vendor: Phoenix Technologies LTD
+	Version: 6.00
+	Release Date: {date}
+	Address: {address}
+	Runtime Size: 88800 bytes
+	ROM Size: 64 kB
+	Characteristics:
+		ISA is supported
+		PCI is supported
+		PC Card (PCMCIA) is supported
+		PNP is supported
+		APM is supported
+		BIOS is upgradeable
+		BIOS shadowing is allowed
+		ESCD support is available
+		Boot from CD is supported
+		Selectable boot is supported
+		EDD is supported
+		Print screen service is supported (int 5h)
+		8042 keyboard services are supported (int 9h)
+		Serial services are supported (int 14h)
+		Printer services are supported (int 17h)
+		CGA/mono video services are supported (int 10h)
+		ACPI is supported
+		Smart battery is supported
+		BIOS boot specification is supported
+		Function key-initiated network boot is supported
+		Targeted content distribution is supported
+	BIOS Revision: 4.6
+	Firmware Revision: 0.0
+
+'''
+
+def synthetic_builds(num_builds, seed=0):
+    '''
+        Return a list of made-up releases, oldest first, as dicts of
+            major, update, descriptor, release_name, date, build_number, installer_build_number
+    '''
+    rng = random.Random(seed)
+    builds = []
+    build_number = 100000
+    release_date = datetime.date(2009, 1, 1)
+    per_major, extra = divmod(num_builds, len(MAJORS))
+    for major_index, major in enumerate(MAJORS):
+        update = 0
+        patch = 0
+        for release in range(per_major + (1 if major_index < extra else 0)):
+            if release == 0:
+                descriptor = 'GA'
+            elif release % RELEASES_PER_UPDATE == 0:
+                update += 1
+                patch = 0
+                descriptor = f'U{update}'
+            else:
+                patch += 1
+                descriptor = f'EP {patch:02d}'
+            # Leave room for an installer build number that doesn't collide with the next build.
+            build_number += rng.randint(100, 5000)
+            release_date += datetime.timedelta(days=rng.randint(0, 3))
+            # Now and then the installer build differs, like the real KB.
+            if rng.random() < 0.05:
+                installer_build_number = str(build_number + rng.randint(1, 50))
+            else:
+                installer_build_number = 'N/A'
+            builds.append({'major': major,
+                           'major_index': major_index,
+                           'update': update,
+                           'descriptor': descriptor,
+                           'release_name': f'ESXi{major.replace(".", "")}-{build_number}',
+                           'date': release_date,
+                           'build_number': str(build_number),
+                           'installer_build_number': installer_build_number})
+    return builds
+
+def kb_row(build):
+    ''' One line of raw_data_from_KB.txt '''
+    date = f'{build["date"].month}/{build["date"].day}/{build["date"].year}'
+    return (f'ESXi {build["major"]} {build["descriptor"]}\t{build["release_name"]}\t{date}\t'
+            f'{build["build_number"]}\t{build["installer_build_number"]}\n')
+
+def bios_for(build, updates_per_bios_date=1):
+    '''
+        The address and date a guest would see.  Pairs of updates share an address.  With
+        updates_per_bios_date above 1, that many updates share a date too, so one BIOS stands
+        for several versions and the rounding (--minor-error-high) paths get exercised.
+    '''
+    segment = (build['major_index'] * 8192 + build['update'] // 2) % 0xEFFF
+    address = f'0x{0x10000 + segment * 0x10:05X}'
+    bios_date = datetime.date(2009, 1, 1) + datetime.timedelta(
+        days=build['major_index'] * 1000 + build['update'] // updates_per_bios_date)
+    return {'address': address, 'date': bios_date.strftime('%m/%d/%Y')}
+
+def dmidecode_text(build, updates_per_bios_date=1):
+    ''' A `dmidecode -t bios` for a guest on this build '''
+    return DMIDECODE_TEMPLATE.format(**bios_for(build, updates_per_bios_date))
+
+def smbios_table(bios, manufacturer='VMware, Inc.'):
+    '''
+        A raw SMBIOS table, as in /sys/firmware/dmi/tables/DMI, holding BIOS Information (type 0)
+        for bios (a bios_for() dict) and System Information (type 1) from manufacturer.
+    '''
+    segment = int(bios['address'], 16) >> 4 if bios['address'].startswith('0x') else 0
+    bios_information = (struct.pack('<BBHBBHBBQ', 0, 0x12, 0x0000, 1, 2, segment, 3, 0, 0) +
+                        b'Phoenix Technologies LTD\0' + b'6.00\0' +
+                        bios['date'].encode('ascii') + b'\0\0')
+    system_information = (struct.pack('<BBHBBBB', 1, 8, 0x0001, 1, 2, 0, 0) +
+                          manufacturer.encode('ascii') + b'\0' + b'VMware Virtual Platform\0\0')
+    end_of_table = struct.pack('<BBH', 127, 4, 0xFEFF) + b'\0\0'
+    return bios_information + system_information + end_of_table
+
+def dump_bin(table):
+    '''
+        The table as `dmidecode --dump-bin` saves it: a 64-bit (_SM3_) entry point, with the
+        table at offset 0x20, where the entry point says it is.
+    '''
+    entry_point = bytearray(struct.pack('<5sBBBBBBBIQ', b'_SM3_', 0, 0x18, 3, 0, 0, 1, 0,
+                                        len(table), 0x20))
+    entry_point[5] = -sum(entry_point) & 0xFF
+    return bytes(entry_point).ljust(0x20, b'\0') + table
+
+def write_corpus(directory, num_builds, dump_fraction=0.25, seed=0, updates_per_bios_date=1):
+    '''
+        Write directory/raw_data_from_KB.txt and directory/dmidecode/dmidecode.NUM.txt.
+        Return (kb filename, dmidecode dirname, number of dumps).
+    '''
+    rng = random.Random(seed)
+    builds = synthetic_builds(num_builds, seed=seed)
+    kb_filename = os.path.join(directory, 'raw_data_from_KB.txt')
+    with open(kb_filename, 'w') as kb_filehandle:
+        kb_filehandle.write('# A synthetic KB scrape from synthetic_corpus.py\n')
+        for build in reversed(builds):
+            kb_filehandle.write(kb_row(build))
+    dmidecode_dirname = os.path.join(directory, 'dmidecode')
+    os.makedirs(dmidecode_dirname, exist_ok=True)
+    dumped = [build for build in builds if rng.random() < dump_fraction]
+    for build in dumped:
+        # Like the real corpus, the dump is named for the build ESX reports.
+        if build['installer_build_number'] != 'N/A':
+            buildnum = build['installer_build_number']
+        else:
+            buildnum = build['build_number']
+        dump_filename = os.path.join(dmidecode_dirname, f'dmidecode.{buildnum}.txt')
+        with open(dump_filename, 'w') as dump_filehandle:
+            dump_filehandle.write(dmidecode_text(build, updates_per_bios_date))
+    return kb_filename, dmidecode_dirname, len(dumped)
+
+def main(prog_args=None):
+    ''' main function '''
+    if prog_args is None:
+        prog_args = sys.argv
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--builds',
+                        type=int,
+                        default=1000,
+                        help='How many KB rows to make up')
+    parser.add_argument('--dump-fraction',
+                        type=float,
+                        default=0.25,
+                        dest='dump_fraction',
+                        help='Fraction of builds that get a dmidecode dump')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Random seed, so corpora are reproducible')
+    parser.add_argument('--updates-per-bios-date',
+                        type=int,
+                        default=1,
+                        dest='updates_per_bios_date',
+                        help='How many updates share a BIOS address and date (default 1)')
+    parser.add_argument('directory',
+                        help='Where to write raw_data_from_KB.txt and dmidecode/')
+    cli_options = parser.parse_args(prog_args[1:])
+    os.makedirs(cli_options.directory, exist_ok=True)
+    write_corpus(cli_options.directory, cli_options.builds,
+                 dump_fraction=cli_options.dump_fraction, seed=cli_options.seed,
+                 updates_per_bios_date=cli_options.updates_per_bios_date)
+
+if __name__ == '__main__':
+    main()